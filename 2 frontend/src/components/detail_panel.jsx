@@ -1,5 +1,6 @@
-import React, { useEffect } from 'react';
+import React, { useState, useEffect } from 'react';
 import { useNavigate } from 'react-router-dom';
+import { fetchDeviceById } from '../services/api';
 
 const formatPrice = (price) => {
   if (!price) return '—';
@@ -29,8 +30,28 @@ const typeIcons = {
   miscellaneous: '✨',
 };
 
-function Detail_Panel({ device, isOpen, onClose }) {
+// device is the card from the grid; the full document is fetched when the panel opens
+function Detail_Panel({ device: card, isOpen, onClose }) {
   const navigate = useNavigate();
+  const [details, setDetails] = useState(null);
+  const cardId = card?._id;
+
+  useEffect(() => {
+    if (!cardId) return undefined;
+    let cancelled = false;
+    const loadDetails = async () => {
+      try {
+        const data = await fetchDeviceById(cardId);
+        if (!cancelled) setDetails(data);
+      } catch (err) {
+        console.error('Failed to load device details:', err);
+      }
+    };
+    loadDetails();
+    return () => {
+      cancelled = true;
+    };
+  }, [cardId]);
 
   useEffect(() => {
     const handleEscape = (e) => {
@@ -46,7 +67,9 @@ function Detail_Panel({ device, isOpen, onClose }) {
     };
   }, [isOpen, onClose]);
 
-  if (!device) return null;
+  if (!card) return null;
+  // the card's fields until the details arrive
+  const device = details && details._id === card._id ? details : card;
 
   const getSpecsForType = () => {
     const baseSpecs = [
@@ -1,4 +1,8 @@
 import React, { useState, useEffect, useRef } from 'react';
+import { fetchDevicePage, searchDevices } from '../services/api';
+
+// devices listed in the dropdown at a time
+const RESULT_LIMIT = 20;
 
 function Device_Pairing({
   currentPairings = [],
@@ -12,29 +16,38 @@ function Device_Pairing({
   const [loading, setLoading] = useState(false);
   const dropdownRef = useRef(null);
 
-  // fetch all devices for dropdown
+  // while the dropdown is open: the first devices by name, or the api's matches for the search
   useEffect(() => {
+    if (!isOpen) return undefined;
+    let cancelled = false;
+    const query = searchQuery.trim();
     const loadDevices = async () => {
       try {
         setLoading(true);
-        const response = await fetch('http://localhost:8000/devices');
-        if (response.ok) {
-          const data = await response.json();
-          // filter out current device and already paired devices
-          const filtered = data.filter(d =>
-            d._id !== excludeId &&
-            !currentPairings.some(p => p.device_id === d._id)
-          );
-          setDevices(filtered);
-        }
+        // one extra for each device that is filtered out below
+        const limit = RESULT_LIMIT + currentPairings.length + 1;
+        const data = query
+          ? await searchDevices(query, { mode: 'autocomplete', limit })
+          : (await fetchDevicePage({ fields: 'card', sort: 'nickname', limit })).devices;
+        if (cancelled) return;
+        // filter out current device and already paired devices
+        const filtered = data.filter(d =>
+          d._id !== excludeId &&
+          !currentPairings.some(p => p.device_id === d._id)
+        );
+        setDevices(filtered.slice(0, RESULT_LIMIT));
       } catch (err) {
         console.error('Failed to load devices:', err);
       } finally {
-        setLoading(false);
+        if (!cancelled) setLoading(false);
       }
     };
-    loadDevices();
-  }, [excludeId, currentPairings]);
+    const timer = setTimeout(loadDevices, query ? 200 : 0);
+    return () => {
+      cancelled = true;
+      clearTimeout(timer);
+    };
+  }, [isOpen, searchQuery, excludeId, currentPairings]);
 
   // close dropdown when clicking outside
   useEffect(() => {
@@ -47,16 +60,6 @@ function Device_Pairing({
     return () => document.removeEventListener('mousedown', handleClickOutside);
   }, []);
 
-  // filter devices based on search
-  const filteredDevices = devices.filter(device => {
-    const query = searchQuery.toLowerCase();
-    return (
-      device.nickname?.toLowerCase().includes(query) ||
-      device.model?.toLowerCase().includes(query) ||
-      device.brand?.toLowerCase().includes(query)
-    );
-  });
-
   const handleAddPairing = (device) => {
     if (currentPairings.length >= maxPairings) return;
 
@@ -207,8 +210,8 @@ function Device_Pairing({
                   <div style={{ padding: 'var(--space-md)', textAlign: 'center', color: 'var(--text-muted)' }}>
                     Loading...
                   </div>
-                ) : filteredDevices.length > 0 ? (
-                  filteredDevices.map((device) => (
+                ) : devices.length > 0 ? (
+                  devices.map((device) => (
                     <button
                       key={device._id}
                       type="button"
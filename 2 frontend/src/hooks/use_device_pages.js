@@ -0,0 +1,66 @@
+import { useState, useEffect, useCallback, useRef } from 'react';
+import { fetchDevicePage } from '../services/api';
+
+// cards per request; the grid asks for the next page when the end of the list scrolls into view
+const PAGE_SIZE = 48;
+
+// device cards (fields=card) one page at a time, starting over whenever params change
+function useDevicePages(params) {
+  const [devices, setDevices] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loading, setLoading] = useState(true);
+  const [loadingMore, setLoadingMore] = useState(false);
+  const [error, setError] = useState(null);
+  const key = JSON.stringify(params);
+  // responses for params that are no longer current are dropped
+  const currentKey = useRef(key);
+
+  useEffect(() => {
+    currentKey.current = key;
+    const loadFirstPage = async () => {
+      try {
+        setLoading(true);
+        const page = await fetchDevicePage({ ...JSON.parse(key), fields: 'card', limit: PAGE_SIZE });
+        if (currentKey.current !== key) return;
+        setDevices(page.devices);
+        setNextCursor(page.nextCursor);
+        setError(null);
+      } catch (err) {
+        if (currentKey.current === key) setError('Failed to load devices. Is the backend running?');
+      } finally {
+        if (currentKey.current === key) setLoading(false);
+      }
+    };
+    loadFirstPage();
+  }, [key]);
+
+  const loadMore = useCallback(async () => {
+    if (!nextCursor || loadingMore) return;
+    try {
+      setLoadingMore(true);
+      const page = await fetchDevicePage({ ...JSON.parse(key), fields: 'card', limit: PAGE_SIZE, cursor: nextCursor });
+      if (currentKey.current !== key) return;
+      setDevices((loaded) => [...loaded, ...page.devices]);
+      setNextCursor(page.nextCursor);
+    } catch (err) {
+      console.error('Error loading more devices:', err);
+    } finally {
+      setLoadingMore(false);
+    }
+  }, [key, nextCursor, loadingMore]);
+
+  // ref for an element after the grid: the next page loads once it is (nearly) visible
+  const [sentinel, sentinelRef] = useState(null);
+  useEffect(() => {
+    if (!sentinel || !nextCursor) return undefined;
+    const observer = new IntersectionObserver((entries) => {
+      if (entries.some((entry) => entry.isIntersecting)) loadMore();
+    }, { rootMargin: '400px' });
+    observer.observe(sentinel);
+    return () => observer.disconnect();
+  }, [sentinel, nextCursor, loadMore]);
+
+  return { devices, loading, loadingMore, error, hasMore: !!nextCursor, loadMore, sentinelRef };
+}
+
+export default useDevicePages;
@@ -1,41 +1,51 @@
 import React, { useState, useEffect } from 'react';
 import { useNavigate } from 'react-router-dom';
+import { fetchStatsSummary } from '../services/api';
+
+// device count of one group of a /stats/summary response
+const groupCount = (summary, field, value) => {
+  const group = summary?.groups.find((row) => row[field] === value);
+  return group ? group.count : 0;
+};
 
 function Categories() {
   const navigate = useNavigate();
-  const [devices, setDevices] = useState([]);
+  const [byType, setByType] = useState(null);
+  const [byStatus, setByStatus] = useState(null);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
 
+  // totals are computed by the api, however large the collection is
   useEffect(() => {
-    const loadDevices = async () => {
+    const loadStats = async () => {
       try {
         setLoading(true);
-        const response = await fetch('http://localhost:8000/devices');
-        if (!response.ok) throw new Error('Failed to fetch');
-        const data = await response.json();
-        setDevices(data);
+        const [typeSummary, statusSummary] = await Promise.all([
+          fetchStatsSummary('device_type'),
+          fetchStatsSummary('status'),
+        ]);
+        setByType(typeSummary);
+        setByStatus(statusSummary);
       } catch (err) {
         setError('Failed to load stats');
       } finally {
         setLoading(false);
       }
     };
-    loadDevices();
+    loadStats();
   }, []);
 
-  // calculate dynamic stats
   const stats = {
-    total: devices.length,
-    totalInvestment: devices.reduce((sum, d) => sum + (d.purchase_price || 0), 0),
-    active: devices.filter(d => d.status === 'active').length,
-    retired: devices.filter(d => d.status === 'retired').length,
-    repairing: devices.filter(d => d.status === 'repairing').length,
+    total: byType?.totals.count || 0,
+    totalInvestment: byType?.totals.purchase_price || 0,
+    active: groupCount(byStatus, 'status', 'active'),
+    retired: groupCount(byStatus, 'status', 'retired'),
+    repairing: groupCount(byStatus, 'status', 'repairing'),
     byType: {
-      computer: devices.filter(d => d.device_type === 'computer').length,
-      camera: devices.filter(d => d.device_type === 'camera').length,
-      appliance: devices.filter(d => d.device_type === 'appliance').length,
-      miscellaneous: devices.filter(d => d.device_type === 'miscellaneous' || d.device_type === 'misc').length,
+      computer: groupCount(byType, 'device_type', 'computer'),
+      camera: groupCount(byType, 'device_type', 'camera'),
+      appliance: groupCount(byType, 'device_type', 'appliance'),
+      miscellaneous: groupCount(byType, 'device_type', 'miscellaneous') + groupCount(byType, 'device_type', 'misc'),
     }
   };
 
@@ -2,14 +2,13 @@ import React, { useState, useEffect } from 'react';
 import { useSearchParams } from 'react-router-dom';
 import Device_Card from '../components/device_card';
 import Detail_Panel from '../components/detail_panel';
+import useDevicePages from '../hooks/use_device_pages';
+import { searchDevices } from '../services/api';
 
 function Dashboard() {
   const [searchParams, setSearchParams] = useSearchParams();
-  const [devices, setDevices] = useState([]);
-  const [filteredDevices, setFilteredDevices] = useState([]);
-  const [loading, setLoading] = useState(true);
-  const [error, setError] = useState(null);
   const [searchQuery, setSearchQuery] = useState('');
+  const [searchResults, setSearchResults] = useState(null);  // null while not searching
   const [categoryFilter, setCategoryFilter] = useState(searchParams.get('category') || 'all');
   const [statusFilter, setStatusFilter] = useState(searchParams.get('status') || 'all');
   const [selectedDevice, setSelectedDevice] = useState(null);
@@ -21,52 +20,42 @@ function Dashboard() {
     if (status) setStatusFilter(status);
   }, [searchParams]);
 
+  // category and status are filtered by the api, the grid loads more cards as it scrolls
+  const filters = {
+    device_type: categoryFilter !== 'all' ? categoryFilter : null,
+    status: statusFilter !== 'all' ? statusFilter : null,
+  };
+  const { devices, loading, loadingMore, error, hasMore, sentinelRef } = useDevicePages(filters);
+
+  // searching asks the api (prefix match on nickname/model/brand) instead of filtering loaded cards
   useEffect(() => {
-    const loadDevices = async () => {
+    const query = searchQuery.trim();
+    if (!query) {
+      setSearchResults(null);
+      return undefined;
+    }
+    let cancelled = false;
+    const timer = setTimeout(async () => {
       try {
-        setLoading(true);
-        const response = await fetch('http://localhost:8000/devices');
-        if (!response.ok) throw new Error('Failed to fetch devices');
-        const data = await response.json();
-        setDevices(data);
-        setError(null);
+        const results = await searchDevices(query, {
+          fields: 'card',
+          limit: 100,
+          device_type: categoryFilter !== 'all' ? categoryFilter : null,
+          status: statusFilter !== 'all' ? statusFilter : null,
+        });
+        if (!cancelled) setSearchResults(results);
       } catch (err) {
-        setError('Failed to load devices. Is the backend running?');
-      } finally {
-        setLoading(false);
+        if (!cancelled) setSearchResults([]);
       }
+    }, 250);
+    return () => {
+      cancelled = true;
+      clearTimeout(timer);
     };
-    loadDevices();
-  }, []);
+  }, [searchQuery, categoryFilter, statusFilter]);
 
-  useEffect(() => {
-    let filtered = devices;
-
-    if (searchQuery) {
-      const query = searchQuery.toLowerCase();
-      filtered = filtered.filter(
-        (device) =>
-          device.nickname?.toLowerCase().includes(query) ||
-          device.model?.toLowerCase().includes(query) ||
-          device.brand?.toLowerCase().includes(query)
-      );
-    }
-
-    if (categoryFilter !== 'all') {
-      filtered = filtered.filter((device) => {
-        if (categoryFilter === 'miscellaneous') {
-          return device.device_type === 'miscellaneous' || device.device_type === 'misc';
-        }
-        return device.device_type === categoryFilter;
-      });
-    }
-
-    if (statusFilter !== 'all') {
-      filtered = filtered.filter((device) => device.status === statusFilter);
-    }
-
-    setFilteredDevices(filtered);
-  }, [searchQuery, categoryFilter, statusFilter, devices]);
+  const filteredDevices = searchResults ?? devices;
+  const moreToLoad = !searchResults && hasMore;
 
   const handleCategoryChange = (value) => {
     setCategoryFilter(value);
@@ -95,7 +84,7 @@ function Dashboard() {
   const handleClosePanel = () => setSelectedDevice(null);
   const hasActiveFilters = categoryFilter !== 'all' || statusFilter !== 'all' || searchQuery;
 
-  if (loading) {
+  if (loading && devices.length === 0) {
     return (
       <div className="loading-container">
         <div className="loading-spinner"></div>
@@ -179,15 +168,24 @@ function Dashboard() {
       <section>
         <div className="section-header">
           <h2 className="section-title">Your Collection</h2>
-          <span className="view-all-btn">{filteredDevices.length} {filteredDevices.length === 1 ? 'item' : 'items'}</span>
+          <span className="view-all-btn">
+            {filteredDevices.length}{moreToLoad ? '+' : ''} {filteredDevices.length === 1 && !moreToLoad ? 'item' : 'items'}
+          </span>
         </div>
 
         {filteredDevices.length > 0 ? (
-          <div className="device-grid">
-            {filteredDevices.map((device) => (
-              <Device_Card key={device._id} device={device} onClick={() => handleCardClick(device)} />
-            ))}
-          </div>
+          <>
+            <div className="device-grid">
+              {filteredDevices.map((device) => (
+                <Device_Card key={device._id} device={device} onClick={() => handleCardClick(device)} />
+              ))}
+            </div>
+            {moreToLoad && (
+              <div ref={sentinelRef} className="loading-container">
+                {loadingMore && <div className="loading-spinner"></div>}
+              </div>
+            )}
+          </>
         ) : (
           <div className="empty-state">
             <div className="empty-state-icon">🔍</div>
@@ -2,9 +2,51 @@ import React, { useState, useEffect } from 'react';
 import { useParams, useNavigate } from 'react-router-dom';
 import Photo_Upload from '../components/photo_upload';
 import Device_Pairing from '../components/device_pairing';
+import { patchDevice } from '../services/api';
 
 const ADMIN_PASSWORD = 'zandryn'; // change later and put on env file
 
+// spec fields shown for each device type
+const TYPE_FIELDS = {
+  computer: ['cpu', 'ram', 'storage', 'os'],
+  camera: ['sensor_type', 'lens_mount', 'megapixels', 'film_type'],
+  appliance: ['battery_life', 'connectivity'],
+  miscellaneous: ['battery_life', 'connectivity'],
+  misc: ['battery_life', 'connectivity'],
+};
+const NUMBER_FIELDS = ['purchase_price', 'megapixels'];
+
+// what the form edits, as the api stores it (null = not set). gallery, repairs and
+// the other photos aren't edited here, so they are never sent and stay as they are
+const formValues = (device) => {
+  const values = {
+    nickname: device.nickname,
+    model: device.model,
+    brand: device.brand,
+    device_type: device.device_type,
+    status: device.status,
+    adopted_date: device.adopted_date?.split('T')[0] || device.adopted_date,
+    purchase_price: device.purchase_price,
+    source: device.source,
+    notes: device.notes,
+    thumbnail: device.thumbnail,
+    hover_photo: device.hover_photo,
+    paired_devices: device.paired_devices || [],
+  };
+  // specs of other device types are cleared, like the form hides them
+  const typeFields = TYPE_FIELDS[device.device_type] || [];
+  Object.values(TYPE_FIELDS).flat().forEach((field) => {
+    values[field] = typeFields.includes(field) ? device[field] : null;
+  });
+  Object.keys(values).forEach((field) => {
+    let value = values[field];
+    if (value === '' || value === undefined) value = null;
+    if (value !== null && NUMBER_FIELDS.includes(field)) value = parseFloat(value);
+    values[field] = value;
+  });
+  return values;
+};
+
 function Edit_Device() {
   const { id } = useParams();
   const navigate = useNavigate();
@@ -14,6 +56,7 @@ function Edit_Device() {
   const [passwordError, setPasswordError] = useState('');
   
   const [device, setDevice] = useState(null);
+  const [original, setOriginal] = useState(null);  // as loaded, to find what changed
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
   const [isSubmitting, setIsSubmitting] = useState(false);
@@ -26,6 +69,7 @@ function Edit_Device() {
         if (!response.ok) throw new Error('Device not found');
         const data = await response.json();
         setDevice(data);
+        setOriginal(data);
       } catch (err) {
         setError('Failed to load device');
       } finally {
@@ -68,48 +112,24 @@ function Edit_Device() {
     setError(null);
 
     try {
-      const submitData = {
-        nickname: device.nickname,
-        model: device.model,
-        brand: device.brand,
-        device_type: device.device_type,
-        status: device.status,
-        adopted_date: device.adopted_date?.split('T')[0] || device.adopted_date,
-        purchase_price: parseFloat(device.purchase_price),
-        source: device.source,
-        notes: device.notes || null,
-        thumbnail: device.thumbnail || null,
-        hover_photo: device.hover_photo || null,
-        paired_devices: device.paired_devices || [],
-      };
-
-      if (device.device_type === 'computer') {
-        if (device.cpu) submitData.cpu = device.cpu;
-        if (device.ram) submitData.ram = device.ram;
-        if (device.storage) submitData.storage = device.storage;
-        if (device.os) submitData.os = device.os;
-      } else if (device.device_type === 'camera') {
-        if (device.sensor_type) submitData.sensor_type = device.sensor_type;
-        if (device.lens_mount) submitData.lens_mount = device.lens_mount;
-        if (device.megapixels) submitData.megapixels = parseFloat(device.megapixels);
-        if (device.film_type) submitData.film_type = device.film_type;
-      } else {
-        if (device.battery_life) submitData.battery_life = device.battery_life;
-        if (device.connectivity) submitData.connectivity = device.connectivity;
+      // PATCH only what was changed, against the version that was loaded
+      const before = formValues(original);
+      const after = formValues(device);
+      const changes = {};
+      Object.keys(after).forEach((field) => {
+        if (JSON.stringify(after[field]) !== JSON.stringify(before[field])) changes[field] = after[field];
+      });
+
+      if (Object.keys(changes).length > 0) {
+        await patchDevice(id, { ...changes, version: original.version });
       }
 
-      const response = await fetch(`http://localhost:8000/devices/${id}`, {
-        method: 'PUT',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify(submitData),
-      });
-      
-      if (!response.ok) throw new Error('Failed to update device');
-      
       setSuccess(true);
       setTimeout(() => navigate('/'), 1500);
     } catch (err) {
-      setError('Failed to update device. Please try again.');
+      setError(err.status === 409
+        ? 'This device was changed somewhere else. Reload the page to see the changes, then edit again.'
+        : 'Failed to update device. Please try again.');
     } finally {
       setIsSubmitting(false);
     }
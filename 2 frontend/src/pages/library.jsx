@@ -1,62 +1,17 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState } from 'react';
 import Device_Card from '../components/device_card';
 import Detail_Panel from '../components/detail_panel';
+import useDevicePages from '../hooks/use_device_pages';
 
 function Library() {
-  const [devices, setDevices] = useState([]);
-  const [loading, setLoading] = useState(true);
-  const [error, setError] = useState(null);
   const [selectedDevice, setSelectedDevice] = useState(null);
   const [sortBy, setSortBy] = useState('adopted_date');
   const [sortOrder, setSortOrder] = useState('desc');
 
-  useEffect(() => {
-    const loadDevices = async () => {
-      try {
-        setLoading(true);
-        const response = await fetch('http://localhost:8000/devices');
-        
-        if (!response.ok) {
-          throw new Error('Failed to fetch devices');
-        }
-        
-        const data = await response.json();
-        setDevices(data);
-        setError(null);
-      } catch (err) {
-        console.error('Error loading devices:', err);
-        setError('Failed to load devices. Is the backend running?');
-      } finally {
-        setLoading(false);
-      }
-    };
-
-    loadDevices();
-  }, []);
-
-  // sort devices
-  const sortedDevices = [...devices].sort((a, b) => {
-    let comparison = 0;
-    
-    switch (sortBy) {
-      case 'adopted_date':
-        comparison = new Date(a.adopted_date) - new Date(b.adopted_date);
-        break;
-      case 'purchase_price':
-        comparison = (a.purchase_price || 0) - (b.purchase_price || 0);
-        break;
-      case 'nickname':
-        comparison = (a.nickname || a.model || '').localeCompare(b.nickname || b.model || '');
-        break;
-      case 'brand':
-        comparison = (a.brand || '').localeCompare(b.brand || '');
-        break;
-      default:
-        comparison = 0;
-    }
-    
-    return sortOrder === 'desc' ? -comparison : comparison;
-  });
+  // sorted by the api, the grid loads more cards as it scrolls
+  const {
+    devices: sortedDevices, loading, loadingMore, error, hasMore, sentinelRef
+  } = useDevicePages({ sort: sortBy, order: sortOrder });
 
   const handleCardClick = (device) => {
     setSelectedDevice(device);
@@ -66,7 +21,7 @@ function Library() {
     setSelectedDevice(null);
   };
 
-  if (loading) {
+  if (loading && sortedDevices.length === 0) {
     return (
       <div className="loading-container">
         <div className="loading-spinner"></div>
@@ -121,15 +76,22 @@ function Library() {
 
       {/* device grid */}
       {sortedDevices.length > 0 ? (
-        <div className="device-grid">
-          {sortedDevices.map((device) => (
-            <Device_Card
-              key={device._id}
-              device={device}
-              onClick={() => handleCardClick(device)}
-            />
-          ))}
-        </div>
+        <>
+          <div className="device-grid">
+            {sortedDevices.map((device) => (
+              <Device_Card
+                key={device._id}
+                device={device}
+                onClick={() => handleCardClick(device)}
+              />
+            ))}
+          </div>
+          {hasMore && (
+            <div ref={sentinelRef} className="loading-container">
+              {loadingMore && <div className="loading-spinner"></div>}
+            </div>
+          )}
+        </>
       ) : (
         <div className="empty-state">
           <div className="empty-state-icon">📦</div>
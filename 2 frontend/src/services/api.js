@@ -1,24 +1,60 @@
 // src/services/api.js
-import axios from 'axios';
-
 const API_BASE_URL = 'http://localhost:8000';
 
-export const fetchDevices = async () => {
-  return await axios.get(`${API_BASE_URL}/devices`);
+const request = async (path, options) => {
+  const response = await fetch(`${API_BASE_URL}${path}`, options);
+  if (!response.ok) {
+    const error = new Error(`${options?.method || 'GET'} ${path} failed (${response.status})`);
+    error.status = response.status;
+    throw error;
+  }
+  return response;
+};
+
+const queryString = (params = {}) => {
+  const query = new URLSearchParams();
+  Object.entries(params).forEach(([name, value]) => {
+    if (value !== undefined && value !== null && value !== '') query.set(name, value);
+  });
+  const text = query.toString();
+  return text ? `?${text}` : '';
+};
+
+// one page of devices; nextCursor (from X-Next-Cursor) is null on the last page
+export const fetchDevicePage = async (params = {}) => {
+  const response = await request(`/devices${queryString(params)}`);
+  return { devices: await response.json(), nextCursor: response.headers.get('X-Next-Cursor') };
 };
 
 export const fetchDeviceById = async (id) => {
-  return await axios.get(`${API_BASE_URL}/devices/${id}`);
+  return (await request(`/devices/${id}`)).json();
 };
 
-export const createDevice = async (deviceData) => {
-  return await axios.post(`${API_BASE_URL}/devices`, deviceData);
+// prefix search on nickname/model/brand (mode: prefix, text or autocomplete)
+export const searchDevices = async (query, params = {}) => {
+  return (await request(`/devices/search/${encodeURIComponent(query)}${queryString(params)}`)).json();
 };
 
-export const updateDevice = async (id, deviceData) => {
-  return await axios.put(`${API_BASE_URL}/devices/${id}`, deviceData);
+export const fetchStatsSummary = async (groupBy) => {
+  return (await request(`/stats/summary${queryString({ group_by: groupBy })}`)).json();
 };
 
+const sendJson = async (method, path, data) => {
+  const response = await request(path, {
+    method,
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify(data),
+  });
+  return response.json();
+};
+
+export const createDevice = async (deviceData) => sendJson('POST', '/devices', deviceData);
+
+export const updateDevice = async (id, deviceData) => sendJson('PUT', `/devices/${id}`, deviceData);
+
+// only the fields in changes are written (null removes one); with version, a concurrent edit fails with 409
+export const patchDevice = async (id, changes) => sendJson('PATCH', `/devices/${id}`, changes);
+
 export const deleteDevice = async (id) => {
-  return await axios.delete(`${API_BASE_URL}/devices/${id}`);
-};
\ No newline at end of file
+  return (await request(`/devices/${id}`, { method: 'DELETE' })).json();
+};
@@ -0,0 +1,33 @@
+# set the long lived Cache-Control on GCS photos uploaded before uploads set it
+#
+# usage: python backfill_cache_control.py
+
+import asyncio
+import os
+from starlette.concurrency import run_in_threadpool
+from storage import get_bucket, immutable_cache_control
+from delivery import is_unique_name
+
+
+async def main():
+    bucket = await get_bucket()
+    if not bucket:
+        print("GCS is not configured, local photos get their headers when they are served")
+        return
+
+    blobs = await run_in_threadpool(lambda: list(bucket.list_blobs(prefix="devices/")))
+    updated = 0
+    for blob in blobs:
+        if not is_unique_name(os.path.basename(blob.name)) or blob.cache_control == immutable_cache_control:
+            continue
+        blob.cache_control = immutable_cache_control
+        try:
+            await run_in_threadpool(blob.patch)
+            updated += 1
+        except Exception as e:
+            print(f"failed on {blob.name}: {e}")
+    print(f"done: {updated} of {len(blobs)} objects updated")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
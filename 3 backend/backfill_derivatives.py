@@ -0,0 +1,62 @@
+# generate resized copies for photos uploaded before derivatives existed
+#
+# usage: python backfill_derivatives.py [--force]
+#   --force  regenerate variants that already exist
+
+import asyncio
+import os
+import sys
+from starlette.concurrency import run_in_threadpool
+import derivatives
+from database import device_collection
+from storage import get_bucket, upload_directory, stored_url
+
+image_extensions = {".jpg", ".jpeg", ".png", ".webp", ".gif", ".tif", ".tiff", ".bmp"}
+
+
+async def list_stored_names():
+    """names of everything under the GCS devices/ prefix, or in ./uploads"""
+    bucket = await get_bucket()
+    if bucket:
+        blobs = await run_in_threadpool(lambda: list(bucket.list_blobs(prefix="devices/")))
+        return [blob.name for blob in blobs]
+    return sorted(os.listdir(upload_directory))
+
+
+async def main():
+    if derivatives.Image is None:
+        print("Pillow is required for the backfill")
+        return
+
+    force = "--force" in sys.argv[1:]
+    names = await list_stored_names()
+    existing = set(names)
+    originals = [
+        name for name in names
+        if os.path.splitext(name)[1].lower() in image_extensions
+        and not derivatives.variant_pattern.search(name)
+    ]
+    print(f"found {len(originals)} original photos")
+
+    generated = 0
+    failed = 0
+    for name in originals:
+        url = stored_url(name, name)
+        variant_names = [derivatives.variant_name(name, variant) for variant in derivatives.variant_sizes]
+        try:
+            if not force and all(variant in existing for variant in variant_names):
+                variants = derivatives.planned_variant_urls(name, name)
+            else:
+                variants = await derivatives.generate(name, name)
+                generated += 1
+            await derivatives.record_variants(device_collection, url, variants)
+        except Exception as e:
+            failed += 1
+            print(f"failed on {name}: {e}")
+
+    await derivatives.stop_worker()
+    print(f"done: {generated} generated, {failed} failed, {len(originals) - generated - failed} already had variants")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,34 @@
+# store search_tokens/search_words on devices written before they existed
+#
+# usage: python backfill_search.py [--batch-size 1000]
+
+import argparse
+import asyncio
+from pymongo import UpdateOne
+from database import device_collection
+from search import field_weights, search_fields
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Backfill the search fields of older devices")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    missing = device_collection.find(
+        {"search_words": {"$exists": False}},
+        {field: 1 for field in field_weights}
+    ).batch_size(args.batch_size)
+    operations = []
+    updated = 0
+    async for device in missing:
+        operations.append(UpdateOne({"_id": device["_id"]}, {"$set": search_fields(device)}))
+        if len(operations) >= args.batch_size:
+            updated += (await device_collection.bulk_write(operations, ordered=False)).modified_count
+            operations = []
+    if operations:
+        updated += (await device_collection.bulk_write(operations, ordered=False)).modified_count
+    print(f"done: {updated} devices updated")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,70 @@
+# cold start: time from launching a worker until /health/ready answers 200
+#
+# usage (from the backend directory):
+#   python -m benchmarks.cold_start                   # in-memory db
+#   python -m benchmarks.cold_start --runs 10 --mongodb-url "mongodb://localhost:27017/?tls=false"
+#
+# the worker's own breakdown (imports, mongodb, indexes, ...) is printed at startup
+# and exported as app_startup_seconds on /metrics.
+
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import httpx
+
+backend_directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def time_to_ready(env, timeout):
+    port = free_port()
+    started = time.perf_counter()
+    worker = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=backend_directory, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            if worker.poll() is not None:
+                raise RuntimeError(f"worker exited:\n{worker.stdout.read()}")
+            try:
+                if httpx.get(f"http://127.0.0.1:{port}/health/ready", timeout=1).status_code == 200:
+                    return time.perf_counter() - started
+            except httpx.TransportError:
+                pass
+            time.sleep(0.02)
+        raise RuntimeError(f"not ready after {timeout}s")
+    finally:
+        worker.terminate()
+        worker.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure worker cold start")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--mongodb-url", default=None, help="local mongod instead of the in-memory stand-in")
+    parser.add_argument("--timeout", type=float, default=60)
+    args = parser.parse_args()
+
+    env = {**os.environ, "MONGODB_URL": args.mongodb_url or "memory://"}
+    env.setdefault("GCS_LOCAL_DIR", os.path.join(tempfile.mkdtemp(prefix="gadgets-cold-start-"), "gcs"))
+
+    timings = []
+    for run in range(args.runs):
+        timings.append(time_to_ready(env, args.timeout))
+        print(f"run {run + 1}: ready after {timings[-1]:.2f}s")
+    print(f"median {statistics.median(timings):.2f}s, max {max(timings):.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+# compare the old response path (str(_id) loop + jsonable_encoder + json.dumps)
+# with encoding.dumps on synthetic device listings
+#
+# usage (from the backend directory): python -m benchmarks.encoding_bench
+
+import copy
+import json
+import timeit
+from fastapi.encoders import jsonable_encoder
+from encoding import dumps, orjson
+from benchmarks.synthetic import catalog
+
+
+def old_path(devices):
+    for device in devices:
+        device["_id"] = str(device["_id"])
+    # what fastapi's JSONResponse does with a returned list of dicts
+    return json.dumps(
+        jsonable_encoder(devices), ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+    ).encode("utf-8")
+
+
+def new_path(devices):
+    return dumps(devices)
+
+
+def measure(function, devices, repeat):
+    # each run gets a fresh copy (the old path mutates _id), copying is not timed
+    copies = [copy.deepcopy(devices) for _ in range(repeat)]
+    times = []
+    for documents in copies:
+        times.append(timeit.timeit(lambda: function(documents), number=1))
+    return min(times)
+
+
+def main():
+    print(f"encoder: {'orjson' if orjson else 'json (orjson not installed)'}")
+    print(f"{'devices':>8} {'old ms':>10} {'new ms':>10} {'speedup':>8}")
+    for count in [100, 1000, 10000]:
+        devices = catalog(count)
+        assert json.loads(old_path(copy.deepcopy(devices))) == json.loads(new_path(copy.deepcopy(devices)))
+        repeat = 5 if count < 10000 else 3
+        old = measure(old_path, devices, repeat)
+        new = measure(new_path, devices, repeat)
+        print(f"{count:>8} {old * 1000:>10.2f} {new * 1000:>10.2f} {old / new:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
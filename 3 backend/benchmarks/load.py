@@ -0,0 +1,289 @@
+# offline load test: seeds a synthetic catalog and drives the api through an asgi client
+#
+# usage (from the backend directory, needs the packages in benchmarks/requirements.txt):
+#   python -m benchmarks.load                        # 1k devices, in-memory db, local gcs stand-in
+#   python -m benchmarks.load --size 100000
+#   python -m benchmarks.load --size 1000000 --mongodb-url "mongodb://localhost:27017/?tls=false"
+#   python -m benchmarks.load --update-baseline      # store these results as the new baseline
+#
+# the in-memory stand-in keeps every document in python objects, use a local mongod
+# (--mongodb-url, with tls=false unless it has tls set up) for the 1M catalog. the
+# database used with --mongodb-url is dropped before seeding, never point it at a
+# real deployment.
+#
+# exits with status 1 when a scenario errors or is slower than the stored baseline allows.
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+backend_directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+default_baseline = os.path.join(backend_directory, "benchmarks", "baseline.json")
+seed_batch_size = 5000
+# ids kept around for the single device / upload scenarios
+id_sample_size = 10000
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline load test for the Gadgets & Gizmos API")
+    parser.add_argument("--size", type=int, default=1000, help="number of synthetic devices to seed")
+    parser.add_argument("--requests", type=int, default=500, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=16, help="requests in flight at the same time")
+    parser.add_argument("--scenarios", default=None, help="comma separated subset of scenarios to run")
+    parser.add_argument("--mongodb-url", default=None, help="local mongod to use instead of the in-memory stand-in")
+    parser.add_argument("--local-uploads", action="store_true", help="use the ./uploads fallback instead of the gcs stand-in")
+    parser.add_argument("--baseline", default=default_baseline, help="baseline file to compare against")
+    parser.add_argument("--update-baseline", action="store_true", help="write the results to the baseline file")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown vs baseline (0.25 = 25%%)")
+    parser.add_argument("--output", default=None, help="also write the results to this json file")
+    parser.add_argument("--seed", type=int, default=42)
+    return parser.parse_args()
+
+
+def configure_environment(args):
+    """must run before the app is imported: database.py and storage.py read these at import"""
+    work_directory = tempfile.mkdtemp(prefix="gadgets-bench-")
+    os.environ["MONGODB_URL"] = args.mongodb_url or "memory://"
+    if args.local_uploads:
+        os.environ.pop("GCS_LOCAL_DIR", None)
+    else:
+        os.environ["GCS_LOCAL_DIR"] = os.path.join(work_directory, "gcs")
+    # ./uploads and friends end up in the scratch directory, not in the repo
+    os.chdir(work_directory)
+    sys.path.insert(0, backend_directory)
+    return work_directory
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux reports kilobytes, macos bytes
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))]
+
+
+async def seed(count, seed_value):
+    """insert a synthetic catalog in batches, returns a sample of the inserted ids"""
+    from database import device_collection
+    from search import search_fields
+    from benchmarks.synthetic import device
+
+    if os.environ["MONGODB_URL"] != "memory://":
+        await device_collection.database.client.drop_database(device_collection.database.name)
+
+    rng = random.Random(seed_value)
+    ids = []
+    remaining = count
+    while remaining:
+        batch = [device(rng) for _ in range(min(seed_batch_size, remaining))]
+        for doc in batch:
+            doc.update(search_fields(doc))
+        await device_collection.insert_many(batch, ordered=False)
+        for doc in batch:
+            if len(ids) < id_sample_size:
+                ids.append(str(doc["_id"]))
+        remaining -= len(batch)
+    return ids
+
+
+def sample_photos(count=32):
+    """small distinct jpegs, so some uploads are new and some are deduplicated"""
+    from PIL import Image
+    photos = []
+    for index in range(count):
+        output = io.BytesIO()
+        Image.new("RGB", (640, 480), ((index * 37) % 256, (index * 91) % 256, (index * 53) % 256)).save(output, "JPEG")
+        photos.append(output.getvalue())
+    return photos
+
+
+def build_scenarios(ids, photos):
+    """name -> async function(client, rng) making one request"""
+    from benchmarks.synthetic import names
+
+    device_types = ["camera", "computer", "appliance", "miscellaneous"]
+
+    def prefix(rng):
+        return rng.choice(names).split()[0][:rng.randint(2, 4)]
+
+    async def list_devices(client, rng):
+        return await client.get("/devices", params={"limit": 100})
+
+    async def list_cards(client, rng):
+        return await client.get("/devices", params={
+            "limit": 100, "fields": "card", "sort": "adopted_date", "order": "desc",
+            "device_type": rng.choice(device_types)
+        })
+
+    async def get_device(client, rng):
+        return await client.get(f"/devices/{rng.choice(ids)}")
+
+    async def search(client, rng):
+        return await client.get(f"/devices/search/{prefix(rng)}")
+
+    async def autocomplete(client, rng):
+        return await client.get(f"/devices/search/{prefix(rng)}", params={"mode": "autocomplete"})
+
+    async def upload(client, rng):
+        return await client.post(
+            "/upload-photo",
+            files={"file": ("photo.jpg", rng.choice(photos), "image/jpeg")},
+            data={"photo_type": "thumbnail"}
+        )
+
+    async def device_upload(client, rng):
+        return await client.post(
+            f"/devices/{rng.choice(ids)}/upload-photo",
+            files=[("file", ("photo.jpg", rng.choice(photos), "image/jpeg")) for _ in range(2)],
+            data={"photo_type": "gallery"}
+        )
+
+    # reads first, uploads change devices (and invalidate the response cache)
+    return {
+        "list": list_devices,
+        "list_cards": list_cards,
+        "get": get_device,
+        "search": search,
+        "autocomplete": autocomplete,
+        "upload": upload,
+        "device_upload": device_upload,
+    }
+
+
+async def run_scenario(client, make_request, total, concurrency, seed_value):
+    rng = random.Random(seed_value)
+    latencies = []
+    errors = []
+    remaining = [total]
+
+    async def worker():
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            started = time.perf_counter()
+            response = await make_request(client, rng)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors.append(f"{response.status_code}: {response.text[:200]}")
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": total,
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "throughput_rps": round(total / elapsed, 1),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """list of regression messages (empty when everything is within tolerance)"""
+    regressions = []
+    for name, result in results.items():
+        if result["errors"]:
+            regressions.append(f"{name}: {result['errors']} failed requests ({result['first_error']})")
+        base = baseline.get(name)
+        if not base:
+            continue
+        if result["p99_ms"] > base["p99_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p99 {result['p99_ms']} ms vs baseline {base['p99_ms']} ms")
+        if result["throughput_rps"] < base["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{name}: {result['throughput_rps']} req/s vs baseline {base['throughput_rps']} req/s")
+        if result["peak_rss_mb"] and base.get("peak_rss_mb") and result["peak_rss_mb"] > base["peak_rss_mb"] * (1 + tolerance):
+            regressions.append(f"{name}: peak rss {result['peak_rss_mb']} MB vs baseline {base['peak_rss_mb']} MB")
+    return regressions
+
+
+async def run(args):
+    import httpx
+    from main import app
+
+    print(f"seeding {args.size} devices...")
+    started = time.perf_counter()
+    ids = await seed(args.size, args.seed)
+    print(f"seeded in {time.perf_counter() - started:.1f}s, peak rss {peak_rss_mb()} MB")
+
+    scenarios = build_scenarios(ids, sample_photos())
+    if args.scenarios:
+        wanted = [name.strip() for name in args.scenarios.split(",")]
+        unknown = [name for name in wanted if name not in scenarios]
+        if unknown:
+            raise SystemExit(f"unknown scenarios: {unknown}, pick from {list(scenarios)}")
+        scenarios = {name: scenarios[name] for name in wanted}
+
+    results = {}
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for name, make_request in scenarios.items():
+                # warm up (caches, indexes, thread pool) without measuring
+                await run_scenario(client, make_request, min(20, args.requests), args.concurrency, args.seed)
+                results[name] = await run_scenario(client, make_request, args.requests, args.concurrency, args.seed)
+                result = results[name]
+                print(
+                    f"{name:>14}: p50 {result['p50_ms']:>8} ms  p99 {result['p99_ms']:>8} ms  "
+                    f"{result['throughput_rps']:>8} req/s  rss {result['peak_rss_mb']} MB  errors {result['errors']}"
+                )
+    return results
+
+
+def main():
+    args = parse_args()
+    configure_environment(args)
+    results = asyncio.run(run(args))
+
+    backend = "mongodb" if args.mongodb_url else "memory"
+    baseline_key = f"{backend}/{args.size}/c{args.concurrency}"
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({baseline_key: results}, f, indent=2)
+
+    if args.update_baseline:
+        baselines[baseline_key] = results
+        with open(args.baseline, "w") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"baseline '{baseline_key}' written to {args.baseline}")
+        return
+
+    if baseline_key not in baselines:
+        print(f"no baseline for '{baseline_key}' yet (run with --update-baseline to store one)")
+    regressions = compare(results, baselines.get(baseline_key, {}), args.tolerance)
+    if regressions:
+        print("REGRESSIONS:")
+        for regression in regressions:
+            print(f"  {regression}")
+        sys.exit(1)
+    print("no regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+# synthetic device documents for benchmarks (shaped like what motor returns)
+
+import random
+from datetime import datetime, timedelta
+from bson import ObjectId
+
+brands = {
+    "camera": ["Canon", "Nikon", "Fujifilm", "Olympus", "Pentax", "Minolta", "Sony"],
+    "computer": ["Apple", "IBM", "Lenovo", "Dell", "Compaq", "Toshiba", "Sony"],
+    "appliance": ["Breville", "Sunbeam", "Philips", "Braun", "Kenwood"],
+    "miscellaneous": ["Nintendo", "Casio", "Texas Instruments", "Walkman", "Polaroid"],
+}
+words = ["mark", "pro", "mini", "classic", "turbo", "deluxe", "zoom", "plus", "lite", "max"]
+names = ["old faithful", "bertha", "pixel", "toasty", "clicky", "beige box", "shutterbug", "gizmo", "sparky"]
+
+
+def photo_url(rng):
+    return f"/static/{rng.getrandbits(256):064x}.jpg"
+
+
+def repair(rng, start):
+    return {
+        "date": start + timedelta(days=rng.randint(0, 2000)),
+        "type": rng.choice(["repair", "upgrade", "maintenance"]),
+        "description": "replaced " + " ".join(rng.choices(words, k=6)),
+        "parts_used": [
+            {"name": rng.choice(words), "cost": round(rng.uniform(1, 120), 2)}
+            for _ in range(rng.randint(0, 4))
+        ],
+        "time_spent": round(rng.uniform(0.25, 12), 2),
+        "photos_before_after": [photo_url(rng) for _ in range(rng.randint(0, 2))],
+    }
+
+
+def device(rng, with_id=True):
+    device_type = rng.choice(list(brands))
+    adopted = datetime(2005, 1, 1) + timedelta(days=rng.randint(0, 7000))
+    doc = {
+        "nickname": f"{rng.choice(names)} {rng.randint(1, 999)}",
+        "model": f"{rng.choice(words).title()} {rng.randint(10, 9999)}",
+        "brand": rng.choice(brands[device_type]),
+        "device_type": device_type,
+        "adopted_date": adopted,
+        "purchase_price": round(rng.uniform(5, 3000), 2),
+        "source": rng.choice(["ebay", "thrift store", "gift", "garage sale", "retail"]),
+        "current_value": round(rng.uniform(5, 3000), 2),
+        "status": rng.choice(["active", "active", "active", "retired", "repairing"]),
+        "notes": " ".join(rng.choices(words, k=rng.randint(0, 30))),
+        "thumbnail": photo_url(rng),
+        "hover_photo": photo_url(rng),
+        "gallery": [
+            {"url": photo_url(rng), "caption": rng.choice([None, "front", "back", "inside"]), "paired_device_id": None}
+            for _ in range(rng.randint(0, 8))
+        ],
+        "paired_devices": [],
+        "repairs": [repair(rng, adopted) for _ in range(rng.randint(0, 6))],
+        "version": rng.randint(1, 20),
+        "updated_at": adopted + timedelta(days=rng.randint(0, 500)),
+    }
+    if with_id:
+        doc["_id"] = ObjectId()
+    return doc
+
+
+def catalog(count, seed=42, with_id=True):
+    rng = random.Random(seed)
+    return [device(rng, with_id) for _ in range(count)]
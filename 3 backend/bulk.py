@@ -0,0 +1,194 @@
+# streaming bulk export (ndjson / csv) and batched import of devices
+
+import csv
+import io
+import json
+from bson import ObjectId
+from encoding import dumps
+from pydantic import ValidationError
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from starlette.concurrency import run_in_threadpool
+from models import Device, DeviceBase
+from search import search_fields
+from cache import now
+from photos import photo_urls, add_refs, variant_fields, generated_variants, assign_variants, queue_variants
+
+export_formats = ["ndjson", "csv"]
+export_batch_size = 500
+default_import_batch_size = 500
+max_reported_errors = 100
+
+# columns holding lists/objects, written to csv cells as json
+nested_fields = [
+    name for name in DeviceBase.model_fields
+    if name in ("gallery", "paired_devices", "repairs") or name.endswith("_variants")
+]
+csv_columns = ["_id"] + list(DeviceBase.model_fields) + ["version", "updated_at"]
+
+
+async def export_ndjson(cursor):
+    """one json document per line, read from the cursor a batch at a time"""
+    async for device in cursor:
+        yield dumps(device) + b"\n"
+
+
+async def export_csv(cursor):
+    """header row, then one row per device (nested fields as json)"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=csv_columns, extrasaction="ignore")
+    writer.writeheader()
+    async for device in cursor:
+        # round trip through the encoder turns bson types into plain json values
+        row = json.loads(dumps(device))
+        for field in nested_fields:
+            if field in row:
+                row[field] = json.dumps(row[field], separators=(",", ":"))
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _from_csv_row(row):
+    device = {}
+    for field, value in row.items():
+        if value is None or value == "":
+            continue  # empty cell means "not set"
+        device[field] = json.loads(value) if field in nested_fields else value
+    return device
+
+
+def parse_batches(binary_file, file_format, batch_size):
+    """
+    Read an uploaded file row by row (constant memory) and yield batches of
+    (row_number, Device or error message). An exported _id is kept, so the
+    references between devices survive a round trip.
+    """
+    text = io.TextIOWrapper(binary_file, encoding="utf-8-sig", newline="")
+    if file_format == "csv":
+        raw_rows, convert = csv.DictReader(text), _from_csv_row
+    else:
+        raw_rows, convert = (line for line in text if line.strip()), json.loads
+
+    batch = []
+    for row_number, raw_row in enumerate(raw_rows, start=1):
+        try:
+            row = convert(raw_row)
+        except ValueError as e:
+            # a malformed row: report it and keep going with the next one
+            batch.append((row_number, f"could not parse row: {e}"))
+        else:
+            try:
+                device = Device.model_validate(row)
+                if device.id is not None and not ObjectId.is_valid(device.id):
+                    batch.append((row_number, f"_id: not an ObjectId: {device.id}"))
+                else:
+                    batch.append((row_number, device))
+            except ValidationError as e:
+                errors = "; ".join(
+                    f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" for error in e.errors()
+                )
+                batch.append((row_number, errors))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+    text.detach()
+
+
+def _document(device: Device):
+    device_dict = device.model_dump(by_alias=True, exclude_none=True)
+    if "_id" in device_dict:
+        device_dict["_id"] = ObjectId(device_dict["_id"])
+    device_dict.update(search_fields(device_dict))
+    device_dict["updated_at"] = now()
+    return device_dict
+
+
+async def _write_batch(collection, rows, upsert_on, report):
+    """insert (or upsert on the natural key) one batch; unordered so one bad row doesn't stop the rest"""
+    documents = [(row_number, _document(device)) for row_number, device in rows]
+    if upsert_on and "_id" in upsert_on:
+        for row_number, device_dict in documents:
+            if "_id" not in device_dict:
+                _add_error(report, row_number, "_id is required to upsert on it")
+        documents = [(row_number, device_dict) for row_number, device_dict in documents if "_id" in device_dict]
+    if not documents:
+        return
+
+    # variant maps come from the photos, not from the file (one lookup per batch)
+    generated = await generated_variants([url for _, device_dict in documents for url in photo_urls(device_dict)])
+    missing_variants = []
+    for row_number, device_dict in documents:
+        missing_variants += await assign_variants(device_dict, generated=generated)
+
+    failed_indexes = set()
+    try:
+        if upsert_on:
+            operations = []
+            for row_number, device_dict in documents:
+                key = {field: device_dict.get(field) for field in upsert_on}
+                # _id can't be changed: a matched device keeps its own, a new one gets the exported id
+                fields = {name: value for name, value in device_dict.items() if name != "_id"}
+                update = {"$set": fields, "$inc": {"version": 1}}
+                if "_id" in device_dict and "_id" not in upsert_on:
+                    update["$setOnInsert"] = {"_id": device_dict["_id"]}
+                stale_maps = {field: "" for field in variant_fields.values() if field not in device_dict}
+                if stale_maps:
+                    update["$unset"] = stale_maps
+                operations.append(UpdateOne(key, update, upsert=True))
+            result = await collection.bulk_write(operations, ordered=False)
+            report["inserted"] += result.upserted_count
+            report["updated"] += result.matched_count
+        else:
+            for row_number, device_dict in documents:
+                device_dict["version"] = 1
+            result = await collection.insert_many([doc for _, doc in documents], ordered=False)
+            report["inserted"] += len(result.inserted_ids)
+    except BulkWriteError as e:
+        details = e.details
+        report["inserted"] += details.get("nInserted", 0) + details.get("nUpserted", 0)
+        report["updated"] += details.get("nMatched", 0)
+        for error in details.get("writeErrors", []):
+            failed_indexes.add(error["index"])
+            _add_error(report, documents[error["index"]][0], error.get("errmsg", "write failed"))
+
+    # imported photos count as references (an upserted device may already have
+    # held them, over-counting only means a photo is kept around longer)
+    urls = []
+    for index, (row_number, device_dict) in enumerate(documents):
+        if index not in failed_indexes:
+            urls += photo_urls(device_dict)
+    await add_refs(urls)
+    queue_variants(dict.fromkeys(missing_variants))
+
+
+def _add_error(report, row_number, message):
+    report["failed"] += 1
+    if len(report["errors"]) < max_reported_errors:
+        report["errors"].append({"row": row_number, "error": message})
+
+
+async def import_devices(collection, binary_file, file_format, batch_size, upsert_on=None):
+    """
+    Validate and write devices from an ndjson or csv file in batches.
+    upsert_on: list of fields that identify an existing device (e.g. _id, or brand, model, nickname)
+    """
+    report = {"inserted": 0, "updated": 0, "failed": 0, "errors": []}
+    batches = parse_batches(binary_file, file_format, batch_size)
+    while True:
+        # parsing is blocking file i/o + validation, keep it off the event loop
+        batch = await run_in_threadpool(next, batches, None)
+        if batch is None:
+            break
+        valid = []
+        for row_number, device in batch:
+            if isinstance(device, DeviceBase):
+                valid.append((row_number, device))
+            else:
+                _add_error(report, row_number, device)
+        await _write_batch(collection, valid, upsert_on, report)
+    return report
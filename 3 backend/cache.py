@@ -0,0 +1,166 @@
+# response caching for device reads: etags, conditional gets and an in-process LRU cache
+#
+# every device carries a version (bumped by every edit, it is also what clients send
+# back for optimistic concurrency) and an updated_at (moved by every write, including
+# background bookkeeping such as recorded variant maps), and the devices collection
+# has a generation counter (bumped on any device write). cached responses remember
+# the version/updated_at/generation they were built from, so a cheap lookup tells
+# whether they are still valid - even when another worker process did the write.
+
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from fastapi import Request, Response
+from database import meta_collection
+from encoding import dumps
+
+cache_max_entries = int(os.getenv("RESPONSE_CACHE_SIZE", "1000"))
+# total size of the cached response bodies; a body bigger than this is not cached
+cache_max_bytes = int(float(os.getenv("RESPONSE_CACHE_MB", "64")) * 1024 * 1024)
+cache_ttl_seconds = float(os.getenv("RESPONSE_CACHE_TTL", "300"))
+
+
+class ResponseCache:
+    """bounded LRU cache with a time to live, counting hits and misses"""
+
+    def __init__(self, max_entries, ttl, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, entry, size)
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def __contains__(self, key):
+        """membership test that does not count as a lookup"""
+        return key in self._entries
+
+    def get(self, key, valid=None):
+        """cached entry for key, or None. valid(entry) can reject stale entries"""
+        item = self._entries.get(key)
+        if item is not None:
+            expires_at, entry, _ = item
+            if expires_at > time.monotonic() and (valid is None or valid(entry)):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self._discard(key)
+        self.misses += 1
+        return None
+
+    def set(self, key, entry, size=0):
+        """size: bytes the entry holds (its response body), counted against max_bytes"""
+        self._discard(key)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, entry, size)
+        self.size_bytes += size
+        while len(self._entries) > self.max_entries or (
+                self.max_bytes is not None and self.size_bytes > self.max_bytes):
+            _, (_, _, evicted_size) = self._entries.popitem(last=False)
+            self.size_bytes -= evicted_size
+
+    def _discard(self, key):
+        item = self._entries.pop(key, None)
+        if item is not None:
+            self.size_bytes -= item[2]
+
+    def invalidate(self, match=None):
+        """drop entries whose key satisfies match(key), or everything"""
+        if match is None:
+            removed = len(self._entries)
+            self._entries.clear()
+            self.size_bytes = 0
+        else:
+            keys = [key for key in self._entries if match(key)]
+            for key in keys:
+                self._discard(key)
+            removed = len(keys)
+        self.invalidations += removed
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "size_bytes": self.size_bytes,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            "invalidations": self.invalidations,
+        }
+
+
+response_cache = ResponseCache(cache_max_entries, cache_ttl_seconds, cache_max_bytes)
+
+
+def now():
+    return datetime.now(timezone.utc)
+
+
+def versioned(update):
+    """add the version bump and updated_at to a mongo update document"""
+    update = dict(update)
+    update["$inc"] = {**update.get("$inc", {}), "version": 1}
+    update["$set"] = {**update.get("$set", {}), "updated_at": now()}
+    return update
+
+
+async def current_generation():
+    meta = await meta_collection.find_one({"_id": "devices"}, {"generation": 1})
+    return meta.get("generation", 0) if meta else 0
+
+
+async def devices_changed(device_id=None):
+    """call after every device write: bumps the generation and drops local entries"""
+    await meta_collection.update_one({"_id": "devices"}, {"$inc": {"generation": 1}}, upsert=True)
+    if device_id is None:
+        response_cache.invalidate()
+    else:
+        device_id = str(device_id)
+        response_cache.invalidate(lambda key: key[0] != "device" or key == ("device", device_id))
+
+
+def render(content):
+    """serialize a response body once and compute its strong etag"""
+    body = dumps(content)
+    etag = '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+    return body, etag
+
+
+async def cached_json(request: Request, key, build):
+    """
+    Conditional response for a collection-wide result, rebuilt with await build()
+    only when a device was written since it was cached.
+    """
+    generation = await current_generation()
+    entry = response_cache.get(key, lambda cached: cached["generation"] == generation)
+    if entry is None:
+        body, etag = render(await build())
+        entry = {"generation": generation, "body": body, "etag": etag}
+        response_cache.set(key, entry, len(body))
+    return conditional_response(request, entry["body"], entry["etag"])
+
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [value.strip() for value in if_none_match.split(",")]
+    # a weak comparison is what If-None-Match asks for
+    return etag in candidates or f"W/{etag}" in candidates
+
+
+def conditional_response(request: Request, body, etag, headers=None):
+    """200 with the body, or 304 when the client already has this version"""
+    headers = {"ETag": etag, "Cache-Control": "no-cache", **(headers or {})}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
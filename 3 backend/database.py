@@ -1,10 +1,13 @@
 # MongoDB connection
 
 import os
+import re
+import asyncio
 from dotenv import load_dotenv
 from motor.motor_asyncio import AsyncIOMotorClient
 from pymongo.server_api import ServerApi
 import certifi  # Add this import
+from metrics import command_metrics, pool_metrics
 
 load_dotenv('mongo.env')
 
@@ -13,15 +16,101 @@ uri = os.getenv("MONGODB_URL")
 if not uri:
     raise ValueError("MONGODB_URL environment variable not set.")
 
-# Add tlsCAFile=certifi.where() to fix SSL issue
-client = AsyncIOMotorClient(
-    uri,
-    server_api=ServerApi('1'),
-    tlsCAFile=certifi.where()  # This fixes the certificate issue
-)
+# connection pool per worker process. with several workers (or autoscaled instances)
+# the cluster sees workers * max_pool_size connections at most
+max_pool_size = int(os.getenv("MONGODB_MAX_POOL_SIZE", "100"))
+min_pool_size = int(os.getenv("MONGODB_MIN_POOL_SIZE", "2"))
+# idle connections above min_pool_size are closed after this long
+max_idle_time_ms = int(os.getenv("MONGODB_MAX_IDLE_TIME_MS", "300000"))
+
+# in-memory stand-in for offline runs (benchmarks), needs mongomock-motor
+in_memory = uri.startswith("memory://")
+
+if in_memory:
+    from mongomock_motor import AsyncMongoMockClient
+    client = AsyncMongoMockClient()
+    print("Using the in-memory MongoDB stand-in, nothing is persisted!")
+else:
+    # the client connects lazily, connect_mongoDB() opens the pool at startup
+    options = {
+        "server_api": ServerApi('1'),
+        "maxPoolSize": max_pool_size,
+        "minPoolSize": min_pool_size,
+        "maxIdleTimeMS": max_idle_time_ms,
+        # command timings, slow query log and pool usage (see metrics.py)
+        "event_listeners": [command_metrics, pool_metrics],
+    }
+    # Add tlsCAFile=certifi.where() to fix SSL issue. it also turns tls on, so it is
+    # left out only when the uri turns tls off (a plain local mongod: ?tls=false)
+    if not re.search(r"[?&](tls|ssl)=false(&|$)", uri, re.IGNORECASE):
+        options["tlsCAFile"] = certifi.where()  # This fixes the certificate issue
+    client = AsyncIOMotorClient(uri, **options)
 
 db = client['gadgets-db']
 device_collection = db['devices']
+photo_collection = db['photos']
+meta_collection = db['meta']
+# recently deleted device ids, so other workers can drop them from their autocomplete index
+deletion_collection = db['deleted_devices']
+# how long a deletion is remembered there
+deletion_log_seconds = int(os.getenv("DELETION_LOG_SECONDS", "86400"))
+
+# internal bookkeeping fields that are never sent to clients
+hidden_fields = {"search_tokens": 0, "search_words": 0}
+
+
+async def ensure_indexes():
+    """create the indexes the listing endpoints rely on (no-op if they exist)"""
+    # keyset pagination by adopted date, price or name, _id breaks ties
+    await device_collection.create_index([("adopted_date", -1), ("_id", -1)])
+    await device_collection.create_index([("purchase_price", -1), ("_id", -1)])
+    await device_collection.create_index([("nickname", 1), ("_id", 1)])
+    await device_collection.create_index([("brand", 1), ("_id", 1)])
+    # filtered grid views (by category and/or status)
+    await device_collection.create_index([("device_type", 1), ("status", 1), ("_id", 1)])
+    await device_collection.create_index([("status", 1), ("_id", 1)])
+    # devices that reference a device (rename refresh, cleanup on delete)
+    await device_collection.create_index([("paired_devices.device_id", 1)], sparse=True)
+    await device_collection.create_index([("gallery.paired_device_id", 1)], sparse=True)
+    # devices written since a point in time (autocomplete catch-up across workers)
+    await device_collection.create_index([("updated_at", 1)])
+    # unused photos for the garbage collection sweep
+    await photo_collection.create_index([("refs", 1), ("leased_until", 1)])
+    # deletions since a point in time, expired after deletion_log_seconds
+    await deletion_collection.create_index([("deleted_at", 1)], expireAfterSeconds=deletion_log_seconds)
+
+async def update_array_items(collection, query, array, match, values, update=None):
+    """
+    $set values on every element of array whose fields equal match, in every
+    document matching query, along with the other operators in update.
+    Returns the number of modified documents. The in-memory stand-in has no
+    array_filters, there the matching documents are rewritten one at a time.
+    """
+    update = dict(update or {})
+    if not in_memory:
+        update["$set"] = {
+            **update.get("$set", {}),
+            **{f"{array}.$[item].{field}": value for field, value in values.items()}
+        }
+        result = await collection.update_many(
+            query, update,
+            array_filters=[{f"item.{field}": value for field, value in match.items()}]
+        )
+        return result.modified_count
+
+    modified = 0
+    async for document in collection.find(query, {array: 1}):
+        items = document.get(array) or []
+        for item in items:
+            if all(item.get(field) == value for field, value in match.items()):
+                item.update(values)
+        result = await collection.update_one(
+            {"_id": document["_id"]},
+            {**update, "$set": {**update.get("$set", {}), array: items}}
+        )
+        modified += result.modified_count
+    return modified
+
 
 async def ping_mongoDB():
     """DEBUGGING"""
@@ -31,4 +120,39 @@ async def ping_mongoDB():
         return True
     except Exception as e:
         print(f"MongoDB connection failed: {e}")
-        return False
\ No newline at end of file
+        return False
+
+
+async def connect_mongoDB():
+    """ping, then open min_pool_size connections so the first requests don't pay for the handshakes"""
+    if not await ping_mongoDB():
+        return False
+    # concurrent pings each need their own connection
+    await asyncio.gather(*(client.admin.command('ping') for _ in range(min_pool_size)), return_exceptions=True)
+    return True
+
+
+def close_mongoDB():
+    client.close()
+
+
+async def mongo_reachable(timeout=2.0):
+    """quiet ping for the readiness check"""
+    try:
+        await asyncio.wait_for(client.admin.command('ping'), timeout)
+        return True
+    except Exception:
+        return False
+
+
+def pool_status():
+    """connection pool usage; saturation is the busiest server's checked out share of max_pool_size"""
+    servers = pool_metrics.servers()
+    in_use = max((server["in_use"] for server in servers.values()), default=0)
+    return {
+        "max_pool_size": max_pool_size,
+        "min_pool_size": min_pool_size,
+        "saturation": round(in_use / max_pool_size, 3),
+        "waiting": sum(server["waiting"] for server in servers.values()),
+        "servers": servers,
+    }
\ No newline at end of file
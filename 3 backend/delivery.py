@@ -0,0 +1,183 @@
+# photo delivery: long lived caching, conditional and byte range requests for the
+# local ./uploads fallback, and /photos/{name} redirects that send clients straight
+# to GCS (public or signed urls) so image bytes never pass through the api workers
+
+import os
+import re
+from datetime import timedelta
+from starlette.staticfiles import StaticFiles, NotModifiedResponse
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from cache import ResponseCache
+from derivatives import variant_sizes
+from storage import (
+    immutable_cache_control, signed_urls, get_bucket, object_name_for, local_name_for
+)
+
+read_chunk_size = 256 * 1024
+signed_url_ttl = int(os.getenv("GCS_SIGNED_URL_TTL", "3600"))
+
+variant_suffix = r"(_(" + "|".join(variant_sizes) + r"))?"
+# content addressed originals and their variants, stored under devices/photos/
+content_name_pattern = re.compile(r"^[0-9a-f]{64}" + variant_suffix + r"\.[0-9a-z]+$")
+# legacy local uploads ("thumbnail_<uuid>.jpg", "<device id>_gallery_<uuid>.png")
+# and their variants; like content addressed names they are never overwritten
+legacy_name_pattern = re.compile(
+    r"(^|_)[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}" + variant_suffix + r"\.[0-9a-z]+$"
+)
+
+# a signed url is handed out again for a quarter of its lifetime, and browsers may
+# keep the redirect for another quarter, so a client never holds an expired one
+_signed_urls = ResponseCache(10000, signed_url_ttl / 4)
+
+
+def is_content_name(name):
+    """a photo /photos/{name} can locate: legacy objects live under per type/device prefixes"""
+    return bool(content_name_pattern.match(name))
+
+
+def is_unique_name(name):
+    return is_content_name(name) or bool(legacy_name_pattern.search(name))
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(range_header, size):
+    """
+    (start, end) inclusive for a single 'bytes=' range, None to send the whole
+    file (no range, a malformed one, or several ranges). RangeNotSatisfiable when
+    the range lies outside the file.
+    """
+    if not range_header or not range_header.startswith("bytes=") or "," in range_header:
+        return None
+    start, _, end = range_header[len("bytes="):].strip().partition("-")
+    try:
+        if not start:
+            # suffix range: the last n bytes
+            length = int(end)
+            if length <= 0:
+                raise RangeNotSatisfiable()
+            return max(0, size - length), size - 1
+        start = int(start)
+        end = int(end) if end else max(start, size - 1)
+    except ValueError:
+        return None
+    if start > end:
+        return None  # invalid, ignored
+    if start >= size:
+        raise RangeNotSatisfiable()
+    return start, min(end, size - 1)
+
+
+def _read_at(file, position, size):
+    file.seek(position)
+    return file.read(size)
+
+
+class PhotoFileResponse(FileResponse):
+    """
+    FileResponse for a whole file or one byte range. Uses the server's zero-copy
+    sendfile extension when it offers one, otherwise reads the file in chunks.
+    """
+
+    def __init__(self, path, stat_result, cache_control, byte_range=None):
+        super().__init__(
+            path, stat_result=stat_result,
+            headers={"Cache-Control": cache_control, "Accept-Ranges": "bytes"}
+        )
+        self.byte_range = byte_range
+        if byte_range is not None:
+            start, end = byte_range
+            self.status_code = 206
+            self.headers["content-length"] = str(end - start + 1)
+            self.headers["content-range"] = f"bytes {start}-{end}/{stat_result.st_size}"
+
+    async def __call__(self, scope, receive, send):
+        start, end = self.byte_range or (0, self.stat_result.st_size - 1)
+        count = end - start + 1
+        extensions = scope.get("extensions") or {}
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+
+        if scope["method"].upper() == "HEAD" or count <= 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        elif "http.response.zerocopysend" in extensions:
+            # the server passes the file descriptor to sendfile(2), the bytes never enter python
+            file = await run_in_threadpool(open, self.path, "rb")
+            try:
+                await send({
+                    "type": "http.response.zerocopysend", "file": file,
+                    "offset": start, "count": count, "more_body": False
+                })
+            finally:
+                await run_in_threadpool(file.close)
+        elif self.byte_range is None and "http.response.pathsend" in extensions:
+            await send({"type": "http.response.pathsend", "path": str(self.path)})
+        else:
+            file = await run_in_threadpool(open, self.path, "rb")
+            try:
+                position = start
+                while position <= end:
+                    size = min(read_chunk_size, end - position + 1)
+                    chunk = await run_in_threadpool(_read_at, file, position, size)
+                    if not chunk:
+                        break  # file got shorter since it was stat'ed
+                    position += len(chunk)
+                    await send({"type": "http.response.body", "body": chunk, "more_body": position <= end})
+                if position <= end:
+                    await send({"type": "http.response.body", "body": b"", "more_body": False})
+            finally:
+                await run_in_threadpool(file.close)
+
+
+class PhotoFiles(StaticFiles):
+    """
+    ./uploads at /static: uniquely named photos are cached for good (immutable),
+    anything else is revalidated. Supports If-None-Match/If-Modified-Since,
+    Range and If-Range.
+    """
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        if status_code != 200:
+            return super().file_response(full_path, stat_result, scope, status_code)
+        request_headers = Headers(scope=scope)
+        name = os.path.basename(full_path)
+        cache_control = immutable_cache_control if is_unique_name(name) else "no-cache"
+
+        response = PhotoFileResponse(full_path, stat_result, cache_control)
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+
+        # If-Range: only honour the range if the client's copy is still this file
+        if_range = request_headers.get("if-range")
+        if if_range and if_range not in (response.headers["etag"], response.headers["last-modified"]):
+            return response
+        try:
+            byte_range = parse_range(request_headers.get("range"), stat_result.st_size)
+        except RangeNotSatisfiable:
+            return Response(status_code=416, headers={"Content-Range": f"bytes */{stat_result.st_size}"})
+        if byte_range is None:
+            return response
+        return PhotoFileResponse(full_path, stat_result, cache_control, byte_range)
+
+
+async def photo_location(name):
+    """(url, Cache-Control for the redirect) of a stored content addressed photo"""
+    bucket = await get_bucket()
+    if bucket is None:
+        return f"/static/{local_name_for(name)}", immutable_cache_control
+    blob = bucket.blob(object_name_for(name))
+    if not signed_urls:
+        return blob.public_url, immutable_cache_control
+
+    url = _signed_urls.get(name)
+    if url is None:
+        # needs credentials that can sign (a service account key, or signBlob permission)
+        url = await run_in_threadpool(
+            blob.generate_signed_url,
+            version="v4", expiration=timedelta(seconds=signed_url_ttl), method="GET"
+        )
+        _signed_urls.set(name, url)
+    return url, f"private, max-age={signed_url_ttl // 4}"
@@ -0,0 +1,173 @@
+# resized webp copies of uploaded photos, generated in the background
+
+import asyncio
+import io
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from storage import save_bytes, read_stored, stored_url, exists_stored, key_from_url
+from cache import now, devices_changed
+from database import photo_collection, update_array_items
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+    print("Warning: Pillow not installed. Photo derivatives will be disabled.")
+
+# longest edge in pixels for each variant
+variant_sizes = {
+    "card": 400,      # polaroid grid thumbnail
+    "hover": 600,     # hover photo on the card
+    "preview": 1024,  # gallery preview
+    "full": 2048,     # detail view
+}
+variant_format = "WEBP"
+variant_extension = ".webp"
+variant_content_type = "image/webp"
+variant_quality = int(os.getenv("DERIVATIVE_QUALITY", "80"))
+
+# names of generated files, so the backfill doesn't resize its own output
+variant_pattern = re.compile(r"_(" + "|".join(variant_sizes) + r")\.webp$")
+
+derivative_workers = int(os.getenv("DERIVATIVE_WORKERS", "2"))
+
+_executor = None
+_queue = None
+_worker_tasks = []
+
+
+def render_variants(data):
+    """
+    Decode an image and return {variant: webp bytes}.
+    Runs in a worker process. EXIF orientation is applied to the pixels and
+    no metadata is written to the output.
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ("RGB", "RGBA"):
+            has_alpha = "A" in image.getbands() or "transparency" in image.info
+            image = image.convert("RGBA" if has_alpha else "RGB")
+        variants = {}
+        for name, size in variant_sizes.items():
+            resized = image.copy()
+            resized.thumbnail((size, size), Image.LANCZOS)
+            output = io.BytesIO()
+            resized.save(output, variant_format, quality=variant_quality, method=4)
+            variants[name] = output.getvalue()
+        return variants
+
+
+def variant_name(name, variant):
+    """storage name of a variant, next to the original"""
+    return f"{os.path.splitext(name)[0]}_{variant}{variant_extension}"
+
+
+def planned_variant_urls(object_name, local_name):
+    """URLs the variants of an upload will have once they are generated"""
+    return {
+        variant: stored_url(variant_name(object_name, variant), variant_name(local_name, variant))
+        for variant in variant_sizes
+    }
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=derivative_workers)
+    return _executor
+
+
+async def generate(object_name, local_name):
+    """create and store every variant of a stored photo, returns {variant: url}"""
+    # photos are content addressed, so existing variants are already up to date
+    planned = planned_variant_urls(object_name, local_name)
+    for variant in variant_sizes:
+        if not await exists_stored(variant_name(object_name, variant), variant_name(local_name, variant)):
+            break
+    else:
+        return planned
+
+    data = await read_stored(object_name, local_name)
+    loop = asyncio.get_running_loop()
+    rendered = await loop.run_in_executor(_get_executor(), render_variants, data)
+    urls = {}
+    for variant, variant_data in rendered.items():
+        urls[variant] = await save_bytes(
+            variant_data,
+            variant_name(object_name, variant),
+            variant_name(local_name, variant),
+            variant_content_type
+        )
+    return urls
+
+
+async def record_variants(collection, url, variants):
+    """
+    Attach a variant map to every device field that uses the original url, and
+    remember it on the photo so devices that use the photo later get it right away.
+    This is bookkeeping, not an edit: updated_at moves (so cached copies go stale)
+    but version doesn't, a client's next write with the version it has still applies.
+    """
+    key = key_from_url(url)
+    if key:
+        await photo_collection.update_one({"_id": key}, {"$set": {"variants": variants}})
+    updated_at = now()
+    modified = [
+        (await collection.update_many(
+            {"thumbnail": url}, {"$set": {"thumbnail_variants": variants, "updated_at": updated_at}}
+        )).modified_count,
+        (await collection.update_many(
+            {"hover_photo": url}, {"$set": {"hover_photo_variants": variants, "updated_at": updated_at}}
+        )).modified_count,
+        # the same photo can be in a gallery more than once, every copy gets the map
+        await update_array_items(
+            collection, {"gallery.url": url}, "gallery",
+            {"url": url}, {"variants": variants},
+            {"$set": {"updated_at": updated_at}}
+        ),
+    ]
+    if any(modified):
+        await devices_changed()
+
+
+async def _worker(collection):
+    while True:
+        url, object_name, local_name = await _queue.get()
+        try:
+            variants = await generate(object_name, local_name)
+            await record_variants(collection, url, variants)
+        except Exception as e:
+            print(f"Error generating derivatives for {url}: {e}")
+        finally:
+            _queue.task_done()
+
+
+def enqueue(url, object_name, local_name):
+    """queue derivative generation for a freshly stored photo (no-op when disabled)"""
+    if _queue is None:
+        return
+    _queue.put_nowait((url, object_name, local_name))
+
+
+def start_worker(collection):
+    """one consumer per pool process, so DERIVATIVE_WORKERS photos are resized at the same time"""
+    global _queue, _worker_tasks
+    if Image is None or _worker_tasks:
+        return
+    _queue = asyncio.Queue()
+    _worker_tasks = [asyncio.create_task(_worker(collection)) for _ in range(derivative_workers)]
+
+
+async def stop_worker():
+    global _queue, _worker_tasks, _executor
+    if _worker_tasks:
+        for task in _worker_tasks:
+            task.cancel()
+        # let the workers finish unwinding before the queue goes away
+        await asyncio.gather(*_worker_tasks, return_exceptions=True)
+        _worker_tasks = []
+        _queue = None
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
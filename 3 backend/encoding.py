@@ -0,0 +1,55 @@
+# fast json encoding of raw mongo documents
+#
+# handlers return documents straight from motor. instead of fastapi's
+# jsonable_encoder (which walks and copies the whole response before json.dumps)
+# the documents are encoded in a single pass, with orjson when it is installed.
+
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from enum import Enum
+from bson import ObjectId, Decimal128
+from fastapi import Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+    print("Warning: orjson not installed. Falling back to the slower json module.")
+
+
+def bson_default(value):
+    """types json can't encode by itself"""
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal128):
+        return float(value.to_decimal())
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, Enum):
+        return value.value
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+if orjson is not None:
+    def dumps(content):
+        """encode to json bytes"""
+        return orjson.dumps(content, default=bson_default)
+else:
+    def dumps(content):
+        """encode to json bytes"""
+        return json.dumps(content, default=bson_default, separators=(",", ":")).encode()
+
+
+class FastJSONResponse(Response):
+    """json response that skips jsonable_encoder and understands bson types"""
+    media_type = "application/json"
+
+    def render(self, content):
+        return dumps(content)
+
+
+def json_response(content, status_code=200, headers=None):
+    return FastJSONResponse(content, status_code=status_code, headers=headers)
@@ -0,0 +1,85 @@
+# a directory on disk that behaves like the parts of a google cloud storage bucket
+# storage.py uses, so the gcs upload path can run offline (GCS_LOCAL_DIR)
+
+import os
+import uuid
+
+
+class LocalBlobWriter:
+    """file writer that only shows up under its name once closed (like a resumable upload)"""
+
+    def __init__(self, path):
+        self._path = path
+        # unique per writer, concurrent uploads of the same content must not share it
+        self._partial_path = f"{path}.{uuid.uuid4()}.part"
+        self._file = open(self._partial_path, "wb")
+
+    def write(self, data):
+        return self._file.write(data)
+
+    def close(self):
+        self._file.close()
+        os.replace(self._partial_path, self._path)
+
+
+class LocalBlob:
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.cache_control = None  # accepted, not stored
+        self._path = os.path.join(bucket.directory, name)
+
+    @property
+    def public_url(self):
+        return f"https://storage.local/{self.bucket.name}/{self.name}"
+
+    def _make_parent(self):
+        os.makedirs(os.path.dirname(self._path), exist_ok=True)
+
+    def open(self, mode="rb", content_type=None, chunk_size=None):
+        if mode != "wb":
+            raise ValueError("only 'wb' is supported")
+        self._make_parent()
+        return LocalBlobWriter(self._path)
+
+    def upload_from_string(self, data, content_type=None):
+        self._make_parent()
+        with open(self._path, "wb") as f:
+            f.write(data)
+
+    def download_as_bytes(self):
+        with open(self._path, "rb") as f:
+            return f.read()
+
+    def make_public(self):
+        pass
+
+    def patch(self):
+        pass
+
+    def generate_signed_url(self, version="v4", expiration=None, method="GET"):
+        seconds = int(expiration.total_seconds()) if expiration else 3600
+        return f"{self.public_url}?X-Goog-Expires={seconds}&X-Goog-Signature=local"
+
+    def exists(self):
+        return os.path.exists(self._path)
+
+    def delete(self):
+        os.remove(self._path)
+
+
+class LocalBucket:
+    def __init__(self, directory, name="local-bucket"):
+        self.directory = directory
+        self.name = name
+        os.makedirs(directory, exist_ok=True)
+
+    def blob(self, name):
+        return LocalBlob(self, name)
+
+    def list_blobs(self, prefix=""):
+        for root, _, files in os.walk(self.directory):
+            for file_name in files:
+                name = os.path.relpath(os.path.join(root, file_name), self.directory).replace(os.sep, "/")
+                if name.startswith(prefix) and not name.endswith(".part"):
+                    yield LocalBlob(self, name)
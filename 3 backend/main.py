@@ -1,52 +1,130 @@
-from fastapi import FastAPI, HTTPException, File, UploadFile, Form
+import time
+import_started = time.perf_counter()
+
+from fastapi import FastAPI, HTTPException, File, UploadFile, Form, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from database import ping_mongoDB, device_collection
-from models import Device, DeviceBase
+from fastapi.responses import StreamingResponse, PlainTextResponse, RedirectResponse
+from database import (
+    client, connect_mongoDB, close_mongoDB, mongo_reachable, pool_status,
+    ensure_indexes, device_collection, hidden_fields
+)
+from models import (
+    DeviceBase, DeviceType, DeviceStatus, DeviceUpdate, RepairEvent, PairedDevice,
+    DeviceDetail, DeviceCard, DeviceSummary, DeviceExpanded
+)
+from encoding import json_response
+from updates import build_patch, remove_at_pipeline, name_fields, photo_fields
+from pagination import (
+    default_page_size, max_page_size, sortable_fields,
+    build_projection, encode_cursor, cursor_filter, sort_spec
+)
+from search import (
+    autocomplete_index, autocomplete_fields, ensure_search_indexes, search_fields, query_tokens, rank_pipeline,
+    record_deletion
+)
+from storage import (
+    upload_directory, storage_status, max_upload_files, UploadLimitMiddleware, save_upload, save_uploads,
+    object_name_for, local_name_for
+)
+from photos import (
+    photo_projection, photo_urls, lease_photo, sweep_unused, sweep_interval_seconds,
+    add_refs, release_refs, update_refs,
+    variant_fields, variant_projection, generated_variants, assign_variants, variant_update, queue_variants
+)
+from cache import (
+    response_cache, versioned, now, current_generation, devices_changed,
+    render, conditional_response, cached_json
+)
+import stats
+import bulk
+import derivatives
+from delivery import PhotoFiles, is_content_name, photo_location
+from references import (
+    parse_expand, DeviceLoader, expand_references, refresh_pairing_names, remove_references, copied_fields
+)
+from metrics import MetricsMiddleware, command_metrics, render_metrics, startup_seconds
+from typing import Optional, List, Union
 from bson import ObjectId
-from google.cloud import storage
+from pymongo import ReturnDocument
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
-import uuid
-import os
+import asyncio
 
 load_dotenv()
 
-# initialize gcs
-storage_client = None
-bucket = None
-
-try:
-    storage_client = storage.Client()
-    bucket_name = os.getenv("GCS_BUCKET_NAME")
-    if bucket_name:
-        bucket = storage_client.bucket(bucket_name)
-        print(f"GCS bucket '{bucket_name}' connected successfully!")
-    else:
-        print("Warning: GCS_BUCKET_NAME not set. Photo uploads will be disabled.")
-except Exception as e:
-    print(f"Warning: Could not initialize GCS: {e}")
-    print("Photo uploads will be disabled.")
+async def load_autocomplete():
+    try:
+        started = time.perf_counter()
+        await autocomplete_index.load(device_collection)
+        startup_seconds.set(("autocomplete",), round(time.perf_counter() - started, 4))
+    except Exception as e:
+        print(f"Could not load the autocomplete index: {e}")
 
-app = FastAPI(title="Gadgets & Gizmos API")
 
-# local upload directory as fallback
-upload_directory = "./uploads"
-if not os.path.exists(upload_directory):
-    os.makedirs(upload_directory)
+async def sweep_photos():
+    """delete photos that were uploaded but never used by a device, every sweep_interval_seconds"""
+    while True:
+        await asyncio.sleep(sweep_interval_seconds)
+        try:
+            swept = await sweep_unused()
+            if swept:
+                print(f"Deleted {swept} unused photos")
+        except Exception as e:
+            print(f"Error sweeping unused photos: {e}")
 
-app.mount("/static", StaticFiles(directory=upload_directory), name="static")
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Open and warm up the mongo pool and make sure the indexes exist before serving.
+    GCS connects on the first upload and the autocomplete index loads in the
+    background, so neither holds up a new worker.
+    """
+    phases = {"import": time.perf_counter() - import_started}
+    started = time.perf_counter()
+    command_metrics.bind(client)
+    background = []
+    if await connect_mongoDB():
+        phases["mongodb"] = time.perf_counter() - started
+        started = time.perf_counter()
+        await asyncio.gather(ensure_indexes(), ensure_search_indexes(device_collection))
+        phases["indexes"] = time.perf_counter() - started
+        background.append(asyncio.create_task(load_autocomplete()))
+        background.append(asyncio.create_task(sweep_photos()))
+    derivatives.start_worker(device_collection)
+
+    for phase, seconds in phases.items():
+        startup_seconds.set((phase,), round(seconds, 4))
+    app.state.started_at = time.time()
+    print(f"Startup took {sum(phases.values()):.2f}s (" + ", ".join(
+        f"{phase} {seconds:.2f}s" for phase, seconds in phases.items()
+    ) + ")")
+
+    yield
+
+    for task in background:
+        task.cancel()
+    await asyncio.gather(*background, return_exceptions=True)
+    await derivatives.stop_worker()
+    close_mongoDB()
+
+
+app = FastAPI(title="Gadgets & Gizmos API", lifespan=lifespan)
+
+# local fallback for photos: immutable caching, conditional and range requests
+app.mount("/static", PhotoFiles(directory=upload_directory), name="static")
+
+# refuses oversized photo uploads before the form is parsed (inside cors, so the 413 has its headers)
+app.add_middleware(UploadLimitMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
-
-
-@app.on_event("startup")
-async def startup():
-    await ping_mongoDB()
+# outermost, so the timings include the other middleware
+app.add_middleware(MetricsMiddleware)
 
 
 @app.get("/")
@@ -54,48 +132,473 @@ async def root():
     return {"message": "Gadgets & Gizmos API is running!"}
 
 
-@app.get("/devices")
-async def get_all_devices():
-    devices_cursor = device_collection.find({})
-    devices = await devices_cursor.to_list(length=None)
-    for device in devices:
-        device["_id"] = str(device["_id"])
-    return devices
+@app.get("/health/live")
+async def liveness():
+    """the worker is up and its event loop responds (never checks dependencies)"""
+    return {
+        "status": "alive",
+        "uptime_seconds": round(time.time() - app.state.started_at, 1),
+        "mongodb_pool": pool_status(),
+    }
 
 
-@app.post("/devices")
+@app.get("/health/ready")
+async def readiness():
+    """
+    503 while mongo can't be reached or every pooled connection is busy with
+    requests queued behind them, so the load balancer sends traffic elsewhere.
+    """
+    pool = pool_status()
+    checks = {
+        "mongodb": await mongo_reachable(),
+        "pool_available": not (pool["saturation"] >= 1 and pool["waiting"] > 0),
+    }
+    ready = all(checks.values())
+    content = {
+        "status": "ready" if ready else "not ready",
+        "checks": checks,
+        "mongodb_pool": pool,
+        "storage": storage_status(),
+        "autocomplete_loaded": autocomplete_index.loaded,
+    }
+    return json_response(content, status_code=200 if ready else 503)
+
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """hit/miss counters of the device response cache (per worker process)"""
+    return response_cache.stats()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """request latency/size and mongodb command metrics in prometheus text format (per worker process)"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/metrics/slow-queries")
+async def slow_queries():
+    """most recent slow mongodb commands with their query plan"""
+    return list(reversed(command_metrics.slow_queries))
+
+
+@app.get("/devices", response_model=List[Union[DeviceExpanded, DeviceDetail, DeviceCard]])
+async def get_all_devices(
+        request: Request,
+        limit: int = Query(default=default_page_size, ge=1, le=max_page_size),
+        cursor: Optional[str] = None,
+        fields: Optional[str] = None,  # full, card, or comma separated field names
+        device_type: Optional[DeviceType] = None,
+        status: Optional[DeviceStatus] = None,
+        sort: str = "_id",  # _id, adopted_date, purchase_price, nickname or brand
+        order: str = "asc",
+        expand: Optional[str] = None  # paired and/or gallery, e.g. "paired,gallery"
+):
+    """
+    List devices one page at a time.
+    The cursor for the next page is returned in the X-Next-Cursor header
+    (header is absent on the last page).
+    expand resolves paired devices / devices tagged in gallery photos inline.
+    Responses carry an ETag; send it back as If-None-Match to get a 304.
+    """
+    if sort not in sortable_fields:
+        raise HTTPException(status_code=400, detail=f"sort must be one of: {sortable_fields}")
+    if order not in ["asc", "desc"]:
+        raise HTTPException(status_code=400, detail="order must be asc or desc")
+    descending = order == "desc"
+
+    try:
+        expand = parse_expand(expand)
+        projection = build_projection(fields, DeviceBase.model_fields)
+        if projection is None:
+            projection = hidden_fields
+        elif sort != "_id":
+            projection[sort] = 1
+
+        query = {}
+        if device_type:
+            query["device_type"] = device_type.value
+        if status:
+            query["status"] = status.value
+        if cursor:
+            query.update(cursor_filter(cursor, sort, descending))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # a cached page is valid as long as no device was written since it was built
+    generation = await current_generation()
+    cache_key = ("list", limit, cursor, fields, query.get("device_type"), query.get("status"), sort, order, expand)
+    entry = response_cache.get(cache_key, lambda cached: cached["generation"] == generation)
+
+    if entry is None:
+        # fetch one extra document to find out if there is a next page
+        devices_cursor = device_collection.find(query, projection) \
+            .sort(sort_spec(sort, descending)) \
+            .limit(limit + 1)
+        devices = await devices_cursor.to_list(length=limit + 1)
+
+        next_cursor = None
+        if len(devices) > limit:
+            devices = devices[:limit]
+            next_cursor = encode_cursor(devices[-1], sort)
+        if expand:
+            await expand_references(devices, expand, DeviceLoader(device_collection))
+
+        body, etag = render(devices)
+        entry = {"generation": generation, "body": body, "etag": etag, "next_cursor": next_cursor}
+        response_cache.set(cache_key, entry, len(body))
+
+    headers = {"X-Next-Cursor": entry["next_cursor"]} if entry["next_cursor"] else None
+    return conditional_response(request, entry["body"], entry["etag"], headers)
+
+
+@app.post("/devices", response_model=DeviceDetail)
 async def create_device(device: DeviceBase):
     device_dict = device.model_dump(by_alias=True, exclude_none=True)
+    device_dict.update(search_fields(device_dict))
+    device_dict["version"] = 1
+    device_dict["updated_at"] = now()
+    missing_variants = await assign_variants(device_dict)
     result = await device_collection.insert_one(device_dict)
-    device_dict["_id"] = str(result.inserted_id)
-    return device_dict
+    device_dict.pop("search_tokens")
+    device_dict.pop("search_words")
+    await add_refs(photo_urls(device_dict))
+    queue_variants(missing_variants)
+    autocomplete_index.upsert(result.inserted_id, device_dict)
+    await devices_changed(result.inserted_id)
+    device_dict["_id"] = result.inserted_id
+    return json_response(device_dict)
+
+
+@app.get("/devices/export")
+async def export_devices(format: str = "ndjson"):
+    """
+    Download every device as ndjson (one json document per line) or csv.
+    Streamed from the database cursor, so memory use doesn't grow with the collection.
+    """
+    if format not in bulk.export_formats:
+        raise HTTPException(status_code=400, detail=f"format must be one of: {bulk.export_formats}")
+
+    devices_cursor = device_collection.find({}, hidden_fields).sort("_id", 1).batch_size(bulk.export_batch_size)
+    if format == "csv":
+        content, media_type = bulk.export_csv(devices_cursor), "text/csv"
+    else:
+        content, media_type = bulk.export_ndjson(devices_cursor), "application/x-ndjson"
+    return StreamingResponse(
+        content,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="devices.{format}"'}
+    )
+
+
+@app.post("/devices/import")
+async def import_devices(
+        file: UploadFile = File(...),
+        format: Optional[str] = Form(default=None),  # ndjson or csv, guessed from the file name if not given
+        batch_size: int = Form(default=bulk.default_import_batch_size, ge=1, le=5000),
+        upsert_on: Optional[str] = Form(default=None)  # e.g. "_id" or "brand,model,nickname"
+):
+    """
+    Import devices from an ndjson or csv file (same layout as /devices/export).
+    Each row is validated on its own and written in unordered batches; rows that
+    fail are reported with their row number. Exported _ids are kept, so pairings and
+    gallery tags still point at the right devices. With upsert_on, a row that matches
+    an existing device on those fields updates it instead of adding a new one.
+    """
+    if format is None:
+        format = "csv" if (file.filename or "").lower().endswith(".csv") else "ndjson"
+    if format not in bulk.export_formats:
+        raise HTTPException(status_code=400, detail=f"format must be one of: {bulk.export_formats}")
+
+    key_fields = None
+    if upsert_on:
+        key_fields = [field.strip() for field in upsert_on.split(",") if field.strip()]
+        unknown = [field for field in key_fields if field != "_id" and field not in DeviceBase.model_fields]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"unknown upsert_on fields: {unknown}")
 
+    report = await bulk.import_devices(device_collection, file.file, format, batch_size, key_fields)
 
-@app.get("/devices/{device_id}")
-async def get_device(device_id: str):
+    if report["inserted"] or report["updated"]:
+        await autocomplete_index.load(device_collection)
+        await devices_changed()
+    return json_response(report)
+
+
+@app.get("/devices/{device_id}", response_model=Union[DeviceExpanded, DeviceDetail])
+async def get_device(request: Request, device_id: str, expand: Optional[str] = None):
+    """
+    Responses carry an ETag; send it back as If-None-Match to get a 304.
+    expand=paired,gallery resolves the referenced devices inline (one query for all of them).
+    """
     try:
-        device = await device_collection.find_one({"_id": ObjectId(device_id)})
-        if device:
-            device["_id"] = str(device["_id"])
-            return device
-        raise HTTPException(status_code=404, detail="Device not found")
+        expand = parse_expand(expand)
+        if expand:
+            # depends on other devices too, so it is cached per generation like the listings
+            async def build():
+                device = await device_collection.find_one({"_id": ObjectId(device_id)}, hidden_fields)
+                if not device:
+                    raise HTTPException(status_code=404, detail="Device not found")
+                await expand_references([device], expand, DeviceLoader(device_collection))
+                return device
+
+            return await cached_json(request, ("expanded", device_id, expand), build)
+
+        cache_key = ("device", device_id)
+        entry = None
+        if cache_key in response_cache:
+            # only the version and updated_at are read to check the cached copy is current
+            current = await device_collection.find_one({"_id": ObjectId(device_id)}, {"version": 1, "updated_at": 1})
+            if not current:
+                raise HTTPException(status_code=404, detail="Device not found")
+            stamp = (current.get("version", 0), current.get("updated_at"))
+            entry = response_cache.get(cache_key, lambda cached: cached["stamp"] == stamp)
+
+        if entry is None:
+            device = await device_collection.find_one({"_id": ObjectId(device_id)}, hidden_fields)
+            if not device:
+                raise HTTPException(status_code=404, detail="Device not found")
+            body, etag = render(device)
+            entry = {"stamp": (device.get("version", 0), device.get("updated_at")), "body": body, "etag": etag}
+            response_cache.set(cache_key, entry, len(body))
+
+        return conditional_response(request, entry["body"], entry["etag"])
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 
-@app.put("/devices/{device_id}")
+@app.put("/devices/{device_id}", response_model=DeviceDetail)
 async def update_device(device_id: str, device: DeviceBase):
     try:
         device_dict = device.model_dump(by_alias=True, exclude_none=True)
-        result = await device_collection.replace_one(
+        device_dict.update(search_fields(device_dict))
+        device_dict["updated_at"] = now()
+        # the previous photos are needed to move photo references (and variant maps) over
+        old_device = await device_collection.find_one(
             {"_id": ObjectId(device_id)},
-            device_dict
+            {**photo_projection, **variant_projection, **{field: 1 for field in copied_fields}, "version": 1}
         )
-        if result.modified_count == 1 or result.matched_count == 1:
-            updated_device = await device_collection.find_one({"_id": ObjectId(device_id)})
-            updated_device["_id"] = str(updated_device["_id"])
-            return updated_device
+        if old_device:
+            missing_variants = await assign_variants(device_dict, old_device)
+            # only replace the version that was read, so the version always moves forward
+            device_dict["version"] = old_device.get("version", 0) + 1
+            result = await device_collection.replace_one(
+                {"_id": ObjectId(device_id), "version": old_device.get("version")},
+                device_dict
+            )
+            if result.matched_count == 0:
+                raise HTTPException(status_code=409, detail="Device was changed by another request, try again")
+            try:
+                await update_refs(old_device, device_dict)
+                queue_variants(missing_variants)
+                autocomplete_index.upsert(device_id, device_dict)
+                if any(old_device.get(field) != device_dict.get(field) for field in copied_fields):
+                    await refresh_pairing_names(device_collection, {**device_dict, "_id": device_id})
+            finally:
+                # the replacement is stored, cached copies go stale even if the bookkeeping failed
+                await devices_changed(device_id)
+            # the replacement is exactly what is stored now, no need to read it back
+            device_dict.pop("search_tokens")
+            device_dict.pop("search_words")
+            device_dict["_id"] = device_id
+            return json_response(device_dict)
         raise HTTPException(status_code=404, detail="Device not found")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+async def not_found_or_conflict(device_id):
+    """a conditional write matched nothing: tell a missing device from a stale version"""
+    if await device_collection.find_one({"_id": ObjectId(device_id)}, {"_id": 1}):
+        return HTTPException(status_code=409, detail="Device was changed by another request, reload and try again")
+    return HTTPException(status_code=404, detail="Device not found")
+
+
+async def after_partial_write(device_id, updated_device, changed):
+    """bookkeeping shared by the PATCH style endpoints, returns the response body"""
+    try:
+        if changed & name_fields:
+            await device_collection.update_one(
+                {"_id": updated_device["_id"]},
+                {"$set": search_fields(updated_device)}
+            )
+        if changed.intersection(autocomplete_fields):
+            autocomplete_index.upsert(device_id, updated_device)
+        if changed & set(copied_fields):
+            # the devices paired with it get new versions, so their cached copies go stale too
+            await refresh_pairing_names(device_collection, updated_device)
+    finally:
+        await devices_changed(device_id)
+    return json_response(updated_device)
+
+
+@app.patch("/devices/{device_id}", response_model=DeviceDetail)
+async def patch_device(device_id: str, patch: DeviceUpdate):
+    """
+    Change only the fields that are sent ($set), fields sent as null are removed ($unset).
+    Send the version you last read to fail with 409 instead of overwriting someone else's edit.
+    """
+    try:
+        update, changed = build_patch(patch)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        device_filter = {"_id": ObjectId(device_id)}
+        if patch.version is not None:
+            device_filter["version"] = patch.version
+
+        old_device = None
+        missing_variants = []
+        if changed & photo_fields:
+            # photo references (and variant maps) move from the old to the new urls,
+            # so the update must apply to exactly the version that was read
+            old_device = await device_collection.find_one(
+                device_filter, {**photo_projection, **variant_projection, "version": 1}
+            )
+            if not old_device:
+                raise await not_found_or_conflict(device_id)
+            device_filter["version"] = old_device.get("version")
+            missing_variants = await variant_update(update, old_device)
+
+        updated_device = await device_collection.find_one_and_update(
+            device_filter,
+            versioned(update),
+            projection=hidden_fields,
+            return_document=ReturnDocument.AFTER
+        )
+        if not updated_device:
+            raise await not_found_or_conflict(device_id)
+
+        if old_device:
+            await update_refs(old_device, updated_device)
+            queue_variants(missing_variants)
+        return await after_partial_write(device_id, updated_device, changed)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.post("/devices/{device_id}/repairs", response_model=DeviceDetail)
+async def add_repair(device_id: str, repair: RepairEvent, version: Optional[int] = None):
+    """Append one repair event to the device's history."""
+    try:
+        device_filter = {"_id": ObjectId(device_id)}
+        if version is not None:
+            device_filter["version"] = version
+        repair_dict = repair.model_dump()
+        updated_device = await device_collection.find_one_and_update(
+            device_filter,
+            versioned({"$push": {"repairs": repair_dict}}),
+            projection=hidden_fields,
+            return_document=ReturnDocument.AFTER
+        )
+        if not updated_device:
+            raise await not_found_or_conflict(device_id)
+        await add_refs(repair_dict["photos_before_after"])
+        return await after_partial_write(device_id, updated_device, {"repairs"})
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.delete("/devices/{device_id}/repairs/{index}", response_model=DeviceDetail)
+async def delete_repair(device_id: str, index: int, version: Optional[int] = None):
+    """Remove the repair event at position index (0 = first) from the device's history."""
+    if index < 0:
+        raise HTTPException(status_code=400, detail="index must be 0 or more")
+    try:
+        device_filter = {"_id": ObjectId(device_id), f"repairs.{index}": {"$exists": True}}
+        if version is not None:
+            device_filter["version"] = version
+        updated_at = now()
+        # the old document is returned so the removed repair's photos can be released
+        device = await device_collection.find_one_and_update(
+            device_filter,
+            remove_at_pipeline("repairs", index, updated_at),
+            projection=hidden_fields
+        )
+        if not device:
+            if version is None and await device_collection.find_one({"_id": ObjectId(device_id)}, {"_id": 1}):
+                raise HTTPException(status_code=404, detail="Repair not found")
+            raise await not_found_or_conflict(device_id)
+
+        removed = device["repairs"].pop(index)
+        device["version"] = device.get("version", 0) + 1
+        device["updated_at"] = updated_at
+        await release_refs(removed.get("photos_before_after") or [])
+        return await after_partial_write(device_id, device, {"repairs"})
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.post("/devices/{device_id}/paired-devices", response_model=DeviceDetail)
+async def add_paired_device(device_id: str, paired: PairedDevice, version: Optional[int] = None):
+    """Pair another device (up to 3). nickname/model are filled in from that device."""
+    try:
+        if paired.device_id == device_id:
+            raise HTTPException(status_code=400, detail="A device can't be paired with itself")
+        target = await device_collection.find_one(
+            {"_id": ObjectId(paired.device_id)},
+            {"nickname": 1, "model": 1}
+        )
+        if not target:
+            raise HTTPException(status_code=404, detail="Paired device not found")
+
+        device_filter = {
+            "_id": ObjectId(device_id),
+            "paired_devices.device_id": {"$ne": paired.device_id},
+            "paired_devices.2": {"$exists": False},  # at most 3 pairings
+        }
+        if version is not None:
+            device_filter["version"] = version
+        pairing = {"device_id": paired.device_id, "nickname": target.get("nickname"), "model": target.get("model")}
+        updated_device = await device_collection.find_one_and_update(
+            device_filter,
+            versioned({"$push": {"paired_devices": pairing}}),
+            projection=hidden_fields,
+            return_document=ReturnDocument.AFTER
+        )
+        if not updated_device:
+            error = await not_found_or_conflict(device_id)
+            if error.status_code == 409 and version is None:
+                error.detail = "Devices are already paired or the device has 3 pairings"
+            raise error
+        return await after_partial_write(device_id, updated_device, {"paired_devices"})
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.delete("/devices/{device_id}/paired-devices/{paired_id}", response_model=DeviceDetail)
+async def delete_paired_device(device_id: str, paired_id: str, version: Optional[int] = None):
+    """Unpair a device."""
+    try:
+        device_filter = {"_id": ObjectId(device_id), "paired_devices.device_id": paired_id}
+        if version is not None:
+            device_filter["version"] = version
+        updated_device = await device_collection.find_one_and_update(
+            device_filter,
+            versioned({"$pull": {"paired_devices": {"device_id": paired_id}}}),
+            projection=hidden_fields,
+            return_document=ReturnDocument.AFTER
+        )
+        if not updated_device:
+            if version is None and await device_collection.find_one({"_id": ObjectId(device_id)}, {"_id": 1}):
+                raise HTTPException(status_code=404, detail="Pairing not found")
+            raise await not_found_or_conflict(device_id)
+        return await after_partial_write(device_id, updated_device, {"paired_devices"})
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
@@ -103,14 +606,44 @@ async def update_device(device_id: str, device: DeviceBase):
 @app.delete("/devices/{device_id}")
 async def delete_device(device_id: str):
     try:
-        result = await device_collection.delete_one({"_id": ObjectId(device_id)})
-        if result.deleted_count == 1:
+        device = await device_collection.find_one_and_delete(
+            {"_id": ObjectId(device_id)},
+            projection=photo_projection
+        )
+        if device:
+            try:
+                await record_deletion(device_id)
+                # pairings with it and gallery tags of it would point nowhere
+                await remove_references(device_collection, device_id)
+                # photos no other device uses are deleted from storage
+                await release_refs(photo_urls(device))
+            finally:
+                await devices_changed(device_id)
             return {"message": "Device deleted successfully"}
         raise HTTPException(status_code=404, detail="Device not found")
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 
+@app.get("/photos/{name}")
+async def get_photo(name: str):
+    """
+    Stable url of a stored photo (or variant): redirects to the public GCS url,
+    a short lived signed url (GCS_SIGNED_URLS=true) or /static for the local
+    fallback, so the image bytes never pass through the api.
+    Only content addressed names (what uploads return), legacy photos keep their own urls.
+    """
+    if not is_content_name(name):
+        raise HTTPException(status_code=404, detail="Photo not found")
+    try:
+        url, cache_control = await photo_location(name)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Could not locate photo: {str(e)}")
+    return RedirectResponse(url, status_code=307, headers={"Cache-Control": cache_control})
+
+
 @app.post("/upload-photo")
 async def upload_photo(
         file: UploadFile = File(...),
@@ -130,30 +663,21 @@ async def upload_photo(
         if photo_type not in valid_types:
             raise HTTPException(status_code=400, detail=f"photo_type must be one of: {valid_types}")
 
-        # generate unique filename
-        file_extension = os.path.splitext(file.filename)[1] if file.filename else '.jpg'
-        unique_filename = f"{photo_type}/{uuid.uuid4()}{file_extension}"
-
         # try GCS first, fall back to local storage
-        if bucket:
-            # upload to gcs
-            blob = bucket.blob(f"devices/{unique_filename}")
-            file.file.seek(0)
-            blob.upload_from_file(file.file, content_type=file.content_type)
-            blob.make_public()
-            image_url = blob.public_url
-        else:
-            # fallback to local storage
-            local_path = os.path.join(upload_directory, unique_filename.replace("/", "_"))
-            file.file.seek(0)
-            with open(local_path, "wb") as f:
-                f.write(file.file.read())
-            image_url = f"/static/{unique_filename.replace('/', '_')}"
+        # (named after the content hash, an identical photo is only stored once)
+        # leased until a device uses it, or swept up after the grace period
+        stored = await save_upload(file, lease_photo)
+        image_url = stored["url"]
+        object_name, local_name = object_name_for(stored["key"]), local_name_for(stored["key"])
+
+        # resized copies are generated in the background, these urls work once it's done
+        derivatives.enqueue(image_url, object_name, local_name)
 
         return {
             "url": image_url,
+            "variants": derivatives.planned_variant_urls(object_name, local_name),
             "photo_type": photo_type,
-            "filename": unique_filename,
+            "filename": stored["key"],
             "message": "Photo uploaded successfully"
         }
 
@@ -167,69 +691,80 @@ async def upload_photo(
 @app.post("/devices/{device_id}/upload-photo")
 async def upload_device_photo(
         device_id: str,
-        file: UploadFile = File(...),
+        file: List[UploadFile] = File(...),
         photo_type: str = Form(default="thumbnail")
 ):
     """
     Upload a photo and automatically attach it to a device.
+    Several files can be sent (repeat the file field) when photo_type is gallery;
+    they are uploaded concurrently and added to the gallery in one update.
     """
     try:
+        files = file
+
+        # validate photo_type
+        valid_types = ["thumbnail", "hover_photo", "gallery"]
+        if photo_type not in valid_types:
+            raise HTTPException(status_code=400, detail=f"photo_type must be one of: {valid_types}")
+        if photo_type != "gallery" and len(files) != 1:
+            raise HTTPException(status_code=400, detail=f"Only one file can be uploaded as {photo_type}")
+        if len(files) > max_upload_files:
+            raise HTTPException(status_code=400, detail=f"At most {max_upload_files} files can be uploaded at once")
+
+        # validate file type
+        for upload in files:
+            if not upload.content_type.startswith('image/'):
+                raise HTTPException(status_code=400, detail="Only image files are allowed")
+
         # verify device exists
-        device = await device_collection.find_one({"_id": ObjectId(device_id)})
+        device = await device_collection.find_one({"_id": ObjectId(device_id)}, {"_id": 1})
         if not device:
             raise HTTPException(status_code=404, detail="Device not found")
 
-        # validate file type
-        if not file.content_type.startswith('image/'):
-            raise HTTPException(status_code=400, detail="Only image files are allowed")
+        # upload to gcs or local (files already stored are not uploaded again)
+        stored = await save_uploads(files, lease_photo)
+        image_urls = [photo["url"] for photo in stored]
+        # photos stored before may already have their resized copies
+        generated = await generated_variants(image_urls)
 
-        # generate unique filename
-        file_extension = os.path.splitext(file.filename)[1] if file.filename else '.jpg'
-        unique_filename = f"devices/{device_id}/{photo_type}/{uuid.uuid4()}{file_extension}"
-
-        # upload to gcs or local
-        if bucket:
-            blob = bucket.blob(unique_filename)
-            file.file.seek(0)
-            blob.upload_from_file(file.file, content_type=file.content_type)
-            blob.make_public()
-            image_url = blob.public_url
-        else:
-            local_path = os.path.join(upload_directory, f"{device_id}_{photo_type}_{uuid.uuid4()}{file_extension}")
-            file.file.seek(0)
-            with open(local_path, "wb") as f:
-                f.write(file.file.read())
-            image_url = f"/static/{os.path.basename(local_path)}"
-
-        # update device with new photo url
-        update_field = {}
-        if photo_type in ["thumbnail", "hover_photo"]:
-            update_field[photo_type] = image_url
-        elif photo_type == "gallery":
+        # update device with new photo url(s)
+        if photo_type == "gallery":
             # add to gallery array
-            await device_collection.update_one(
-                {"_id": ObjectId(device_id)},
-                {"$push": {"gallery": {"url": image_url, "caption": None, "paired_device_id": None}}}
-            )
-            updated_device = await device_collection.find_one({"_id": ObjectId(device_id)})
-            updated_device["_id"] = str(updated_device["_id"])
-            return {"url": image_url, "photo_type": photo_type, "device": updated_device}
+            update = {"$push": {"gallery": {"$each": [
+                {"url": image_url, "caption": None, "paired_device_id": None, "variants": generated.get(image_url)}
+                for image_url in image_urls
+            ]}}}
+        else:
+            # the map of the replaced photo goes with it
+            map_field = variant_fields[photo_type]
+            if image_urls[0] in generated:
+                update = {"$set": {photo_type: image_urls[0], map_field: generated[image_urls[0]]}}
+            else:
+                update = {"$set": {photo_type: image_urls[0]}, "$unset": {map_field: ""}}
+
+        old_device = await device_collection.find_one_and_update(
+            {"_id": ObjectId(device_id)},
+            versioned(update),
+            projection={photo_type: 1}
+        )
+        await devices_changed(device_id)
+        await add_refs(image_urls)
+        if photo_type != "gallery" and old_device:
+            # the replaced thumbnail/hover photo loses a reference
+            await release_refs([old_device.get(photo_type)])
 
-        if update_field:
-            await device_collection.update_one(
-                {"_id": ObjectId(device_id)},
-                {"$set": update_field}
-            )
+        # missing resized copies are recorded on the device by the background worker
+        queue_variants([image_url for image_url in image_urls if image_url not in generated])
 
-        updated_device = await device_collection.find_one({"_id": ObjectId(device_id)})
-        updated_device["_id"] = str(updated_device["_id"])
+        updated_device = await device_collection.find_one({"_id": ObjectId(device_id)}, hidden_fields)
 
-        return {
-            "url": image_url,
+        return json_response({
+            "url": image_urls[0],
+            "urls": image_urls,
             "photo_type": photo_type,
             "device": updated_device,
             "message": "Photo uploaded and attached to device"
-        }
+        })
 
     except HTTPException:
         raise
@@ -238,20 +773,109 @@ async def upload_device_photo(
         raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
 
 
-@app.get("/devices/search/{query}")
-async def search_devices(query: str):
-    """Search devices by nickname, model, or brand for pairing dropdown"""
+@app.get("/devices/search/{query}", response_model=Union[List[DeviceDetail], List[DeviceCard], List[DeviceSummary]])
+async def search_devices(
+        query: str,
+        mode: str = "prefix",  # prefix, text, or autocomplete
+        device_type: Optional[DeviceType] = None,
+        status: Optional[DeviceStatus] = None,
+        fields: Optional[str] = None,
+        limit: int = Query(default=20, ge=1, le=100)
+):
+    """
+    Search devices by nickname, model, or brand for pairing dropdown.
+    prefix: every word of the query must start a word in nickname/model/brand (indexed)
+    text: mongo full-text search ranked by text score
+    autocomplete: in-memory prefix lookup, returns a small view without reading devices
+                  (answered by the prefix search while the index is still loading)
+    The query is always treated as literal text.
+    """
+    if mode not in ["prefix", "text", "autocomplete"]:
+        raise HTTPException(status_code=400, detail="mode must be one of: prefix, text, autocomplete")
+
+    type_filter = device_type.value if device_type else None
+    status_filter = status.value if status else None
+
+    if mode == "autocomplete" and autocomplete_index.loaded:
+        # picks up devices other workers created, changed or deleted
+        await autocomplete_index.refresh(device_collection)
+        return json_response(autocomplete_index.lookup(query, limit, type_filter, status_filter))
+
+    tokens = query_tokens(query)
+    if not tokens:
+        return json_response([])
+
     try:
-        devices_cursor = device_collection.find({
-            "$or": [
-                {"nickname": {"$regex": query, "$options": "i"}},
-                {"model": {"$regex": query, "$options": "i"}},
-                {"brand": {"$regex": query, "$options": "i"}}
-            ]
-        })
-        devices = await devices_cursor.to_list(length=20)
-        for device in devices:
-            device["_id"] = str(device["_id"])
-        return devices
+        if mode == "autocomplete":
+            # index still loading after startup: same view, answered by the prefix search
+            mode, fields = "prefix", ",".join(autocomplete_fields)
+        projection = build_projection(fields, DeviceBase.model_fields) or hidden_fields
+
+        filters = {}
+        if type_filter:
+            filters["device_type"] = type_filter
+        if status_filter:
+            filters["status"] = status_filter
+
+        if mode == "text":
+            projection = {**projection, "score": {"$meta": "textScore"}}
+            devices_cursor = device_collection.find(
+                {"$text": {"$search": " ".join(tokens)}, **filters},
+                projection
+            ).sort([("score", {"$meta": "textScore"})]).limit(limit)
+            devices = await devices_cursor.to_list(length=limit)
+            for device in devices:
+                device.pop("score", None)
+            return json_response(devices)
+
+        # rank every match inside mongo on the stored search_words,
+        # then fetch only the winners with the requested projection
+        ranked = await device_collection.aggregate(rank_pipeline(tokens, filters, limit)).to_list(length=limit)
+        top_ids = [device["_id"] for device in ranked]
+
+        devices_cursor = device_collection.find({"_id": {"$in": top_ids}}, projection)
+        devices = {device["_id"]: device for device in await devices_cursor.to_list(length=limit)}
+        return json_response([devices[device_id] for device_id in top_ids if device_id in devices])
     except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/stats/summary")
+async def stats_summary(request: Request, group_by: str = "device_type"):
+    """
+    Device count, purchase price, current value, repair parts cost and hours,
+    totalled per device_type, status or brand plus an overall total.
+    """
+    if group_by not in stats.group_fields:
+        raise HTTPException(status_code=400, detail=f"group_by must be one of: {stats.group_fields}")
+
+    async def build():
+        groups = await device_collection.aggregate(stats.summary_pipeline(group_by)).to_list(length=None)
+        return stats.summarize(groups, group_by)
+
+    return await cached_json(request, ("stats", "summary", group_by), build)
+
+
+@app.get("/stats/repairs")
+async def stats_repairs(request: Request, months: int = Query(default=12, ge=1, le=120)):
+    """Repairs, parts cost and time spent per month for the last few months."""
+    async def build():
+        return await device_collection.aggregate(stats.repairs_by_month_pipeline(months)).to_list(length=None)
+
+    return await cached_json(request, ("stats", "repairs", months), build)
+
+
+@app.get("/stats/maintenance")
+async def stats_maintenance(
+        request: Request,
+        interval_days: int = Query(default=180, ge=1),
+        limit: int = Query(default=20, ge=1, le=200)
+):
+    """Devices (not retired) ordered by next maintenance: interval_days after their last repair."""
+    async def build():
+        devices = await device_collection.aggregate(
+            stats.maintenance_pipeline(interval_days, limit)
+        ).to_list(length=limit)
+        return stats.shape_maintenance(devices)
+
+    return await cached_json(request, ("stats", "maintenance", interval_days, limit), build)
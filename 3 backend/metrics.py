@@ -0,0 +1,411 @@
+# request and database instrumentation, exported in prometheus text format (/metrics)
+#
+# MetricsMiddleware times every http request and counts request/response bytes per
+# route. CommandMetrics is a pymongo command listener: it times every command, counts
+# the documents it returned and labels it with the handler that issued it. commands
+# slower than SLOW_QUERY_MS are logged together with their explain() plan.
+# PoolMetrics follows the driver's connection pools (open / in use / waiting).
+
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from pymongo import monitoring
+
+slow_query_ms = float(os.getenv("SLOW_QUERY_MS", "100"))  # 0 turns the slow query log off
+slow_query_explain = os.getenv("SLOW_QUERY_EXPLAIN", "true").lower() in ("1", "true", "yes")
+# explain the same (handler, command, collection) at most this often
+explain_interval_seconds = 60
+
+latency_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+size_buckets = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+document_buckets = (0, 1, 10, 100, 1000, 10000, 100000)
+
+# asgi scope of the request being handled (the router adds the matched route/endpoint to it)
+current_scope = ContextVar("current_scope", default=None)
+
+explainable_commands = {"find", "aggregate", "count", "distinct", "update", "delete", "findAndModify"}
+# added by the driver (session, api version, write concern), explain() rejects them
+driver_fields = {
+    "lsid", "txnNumber", "$clusterTime", "$db", "$readPreference", "writeConcern",
+    "apiVersion", "apiStrict", "apiDeprecationErrors",
+}
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Histogram:
+    """prometheus style histogram (cumulative buckets, sum and count) per label set"""
+
+    def __init__(self, name, help_text, label_names, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}  # label values -> [bucket counts, sum, count]
+        self._lock = threading.Lock()  # command events arrive on driver threads
+
+    def observe(self, label_values, value):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((values, list(counts), total, count) for values, (counts, total, count) in self._series.items())
+        for values, counts, total, count in series:
+            for bound, bucket_count in zip(self.buckets, counts):
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, values, le)} {bucket_count}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_labels(self.label_names, values, le)} {count}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, values)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, values)} {count}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def inc(self, label_values, amount=1):
+        with self._lock:
+            self._series[label_values] = self._series.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            series = sorted(self._series.items())
+        for values, value in series:
+            lines.append(f"{self.name}{_labels(self.label_names, values)} {value}")
+        return lines
+
+
+class Gauge:
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._series = {}
+
+    def set(self, label_values, value):
+        self._series[label_values] = value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge"]
+        for values, value in sorted(self._series.items()):
+            lines.append(f"{self.name}{_labels(self.label_names, values)} {value}")
+        return lines
+
+
+http_labels = ("method", "route", "status")
+request_duration = Histogram(
+    "http_request_duration_seconds", "Time spent handling HTTP requests.", http_labels, latency_buckets)
+request_size = Histogram(
+    "http_request_size_bytes", "Size of HTTP request bodies.", http_labels, size_buckets)
+response_size = Histogram(
+    "http_response_size_bytes", "Size of HTTP response bodies.", http_labels, size_buckets)
+
+command_labels = ("command", "collection", "handler")
+command_duration = Histogram(
+    "mongodb_command_duration_seconds", "Time spent in MongoDB commands.", command_labels, latency_buckets)
+command_documents = Histogram(
+    "mongodb_command_documents_returned", "Documents returned per MongoDB command.", command_labels, document_buckets)
+command_failures = Counter(
+    "mongodb_command_failures_total", "MongoDB commands that failed.", command_labels)
+slow_commands = Counter(
+    "mongodb_slow_commands_total", f"MongoDB commands slower than {slow_query_ms:g} ms.", command_labels)
+
+startup_seconds = Gauge("app_startup_seconds", "Time spent in each startup phase of this worker.", ("phase",))
+
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    """connection pool listener: open, checked out and waiting connections per server"""
+
+    def __init__(self):
+        self._servers = {}  # address -> {"open", "in_use", "waiting"}
+        self._lock = threading.Lock()
+
+    def _change(self, event, **deltas):
+        address = "%s:%s" % event.address
+        with self._lock:
+            server = self._servers.setdefault(address, {"open": 0, "in_use": 0, "waiting": 0})
+            for state, delta in deltas.items():
+                server[state] = max(0, server[state] + delta)
+
+    def servers(self):
+        with self._lock:
+            return {address: dict(server) for address, server in self._servers.items()}
+
+    def render(self):
+        lines = [
+            "# HELP mongodb_pool_connections MongoDB connections per server and state (waiting = queued for a connection).",
+            "# TYPE mongodb_pool_connections gauge",
+        ]
+        for address, server in sorted(self.servers().items()):
+            for state, value in server.items():
+                lines.append(f"mongodb_pool_connections{_labels(('server', 'state'), (address, state))} {value}")
+        return lines
+
+    def connection_created(self, event):
+        self._change(event, open=1)
+
+    def connection_closed(self, event):
+        self._change(event, open=-1)
+
+    def connection_check_out_started(self, event):
+        self._change(event, waiting=1)
+
+    def connection_check_out_failed(self, event):
+        self._change(event, waiting=-1)
+
+    def connection_checked_out(self, event):
+        self._change(event, waiting=-1, in_use=1)
+
+    def connection_checked_in(self, event):
+        self._change(event, in_use=-1)
+
+    def pool_closed(self, event):
+        with self._lock:
+            self._servers.pop("%s:%s" % event.address, None)
+
+    # nothing to count (a cleared pool reports each connection it closes)
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+
+pool_metrics = PoolMetrics()
+
+all_metrics = [
+    request_duration, request_size, response_size,
+    command_duration, command_documents, command_failures, slow_commands,
+    pool_metrics, startup_seconds,
+]
+
+
+def render_metrics():
+    """every metric in prometheus text exposition format"""
+    lines = []
+    for metric in all_metrics:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+
+def route_label(scope):
+    """route template (e.g. /devices/{device_id}) so ids don't explode the label set"""
+    route = scope.get("route")
+    if route is not None:
+        return route.path
+    if scope.get("endpoint") is not None:
+        return scope.get("root_path") or "/"  # mounted app, e.g. /static
+    return "unmatched"
+
+
+def handler_label():
+    """name of the endpoint handling the current request, or background (startup, workers)"""
+    scope = current_scope.get()
+    endpoint = scope.get("endpoint") if scope else None
+    return getattr(endpoint, "__name__", "background")
+
+
+class MetricsMiddleware:
+    """records latency and body sizes of every http request"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        sizes = {"request": 0, "response": 0}
+        status = [500]
+
+        async def counting_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                sizes["request"] += len(message.get("body", b""))
+            return message
+
+        async def counting_send(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            elif message["type"] == "http.response.body":
+                sizes["response"] += len(message.get("body", b""))
+            await send(message)
+
+        token = current_scope.set(scope)
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            current_scope.reset(token)
+            labels = (scope["method"], route_label(scope), str(status[0]))
+            request_duration.observe(labels, time.perf_counter() - started)
+            request_size.observe(labels, sizes["request"])
+            response_size.observe(labels, sizes["response"])
+
+
+def _collection(command_name, command):
+    name = command.get("collection") if command_name == "getMore" else command.get(command_name)
+    return name if isinstance(name, str) else ""
+
+
+def documents_returned(command_name, reply):
+    cursor = reply.get("cursor")
+    if isinstance(cursor, dict):
+        return len(cursor.get("firstBatch", cursor.get("nextBatch", [])))
+    if command_name == "findAndModify":
+        return 0 if reply.get("value") is None else 1
+    if command_name == "distinct":
+        return len(reply.get("values", []))
+    return 0
+
+
+def plan_summary(explained):
+    """'FETCH > IXSCAN device_type_1_status_1__id_1' style summary of the winning plan"""
+    def find_winning_plan(value):
+        if isinstance(value, dict):
+            if "winningPlan" in value:
+                return value["winningPlan"]
+            children = value.values()
+        elif isinstance(value, list):
+            children = value
+        else:
+            return None
+        for child in children:
+            plan = find_winning_plan(child)
+            if plan is not None:
+                return plan
+        return None
+
+    plan = find_winning_plan(explained)
+    if plan is None:
+        return "no plan"
+    plan = plan.get("queryPlan", plan)  # slot based engine nests the classic plan
+    stages = []
+    while plan:
+        stage = plan.get("stage", "?")
+        if plan.get("indexName"):
+            stage += f" {plan['indexName']}"
+        stages.append(stage)
+        inputs = plan.get("inputStages") or [plan.get("inputStage")]
+        plan = inputs[0]
+    return " > ".join(stages)
+
+
+class CommandMetrics(monitoring.CommandListener):
+    """pymongo command listener feeding the mongodb_* metrics and the slow query log"""
+
+    def __init__(self):
+        self._pending = {}  # (connection, request id) -> (command, labels)
+        self._lock = threading.Lock()
+        self._client = None
+        self._loop = None
+        self._last_explained = {}
+        self.slow_queries = deque(maxlen=100)
+
+    def bind(self, client):
+        """enable explain() of slow queries; call from the running event loop"""
+        self._client = client
+        self._loop = asyncio.get_running_loop()
+
+    def started(self, event):
+        labels = (event.command_name, _collection(event.command_name, event.command), handler_label())
+        with self._lock:
+            self._pending[(event.connection_id, event.request_id)] = (event.command, event.database_name, labels)
+
+    def _finish(self, event):
+        with self._lock:
+            return self._pending.pop((event.connection_id, event.request_id), None)
+
+    def succeeded(self, event):
+        pending = self._finish(event)
+        if pending is None:
+            return
+        command, database_name, labels = pending
+        seconds = event.duration_micros / 1e6
+        documents = documents_returned(event.command_name, event.reply)
+        command_duration.observe(labels, seconds)
+        command_documents.observe(labels, documents)
+        if slow_query_ms and seconds * 1000 >= slow_query_ms and event.command_name != "explain":
+            self._slow(command, database_name, labels, seconds, documents)
+
+    def failed(self, event):
+        pending = self._finish(event)
+        if pending is None:
+            return
+        command_duration.observe(pending[2], event.duration_micros / 1e6)
+        command_failures.inc(pending[2])
+
+    def _slow(self, command, database_name, labels, seconds, documents):
+        slow_commands.inc(labels)
+        entry = {
+            "command": labels[0], "collection": labels[1], "handler": labels[2],
+            "duration_ms": round(seconds * 1000, 1), "documents": documents,
+            "at": time.time(), "plan": None,
+        }
+        self.slow_queries.append(entry)
+
+        now = time.monotonic()
+        if (slow_query_explain and self._loop is not None and labels[0] in explainable_commands
+                and now - self._last_explained.get(labels, float("-inf")) >= explain_interval_seconds):
+            self._last_explained[labels] = now
+            explained = {key: value for key, value in command.items() if key not in driver_fields}
+            # we are on a driver thread, the explain runs on the event loop
+            asyncio.run_coroutine_threadsafe(self._explain(entry, explained, database_name), self._loop)
+        else:
+            _log_slow(entry)
+
+    async def _explain(self, entry, command, database_name):
+        try:
+            explained = await self._client[database_name].command(
+                {"explain": command, "verbosity": "queryPlanner"}
+            )
+            entry["plan"] = plan_summary(explained)
+        except Exception as e:
+            entry["plan"] = f"explain failed: {e}"
+        _log_slow(entry)
+
+
+def _log_slow(entry):
+    plan = f", plan: {entry['plan']}" if entry["plan"] else ""
+    print(
+        f"Slow query: {entry['command']} on '{entry['collection']}' from {entry['handler']} "
+        f"took {entry['duration_ms']} ms, returned {entry['documents']} documents{plan}"
+    )
+
+
+command_metrics = CommandMetrics()
@@ -1,7 +1,7 @@
 # creating data objects
 
-from pydantic import BaseModel, Field
-from typing import Optional, List
+from pydantic import BaseModel, Field, create_model
+from typing import Optional, List, Dict
 from datetime import datetime
 from enum import Enum
 
@@ -32,6 +32,7 @@ class GalleryPhoto(BaseModel):
     url: str
     caption: Optional[str] = None
     paired_device_id: Optional[str] = None  # link to another device shown in photo
+    variants: Optional[Dict[str, str]] = None  # resized copies {card, hover, preview, full: url}
 
 class PairedDevice(BaseModel):
     device_id: str
@@ -58,6 +59,8 @@ class DeviceBase(BaseModel):
     hover_photo: Optional[str] = None    # shown on hover (aritzia style)
     main_photo: Optional[str] = None     # legacy/fallback
     gallery: List[GalleryPhoto] = []     # additional photos
+    thumbnail_variants: Optional[Dict[str, str]] = None    # resized copies of thumbnail
+    hover_photo_variants: Optional[Dict[str, str]] = None  # resized copies of hover_photo
 
     # paired devices (up to 3)
     paired_devices: List[PairedDevice] = []
@@ -87,3 +90,61 @@ class Device(DeviceBase):
 
     class Config:
         populate_by_name = True
+
+
+# response views (documentation only, handlers return pre-encoded bodies)
+
+class DeviceDetail(Device):
+    version: Optional[int] = None
+    updated_at: Optional[datetime] = None
+
+class DeviceCard(BaseModel):
+    # fields=card: what the polaroid grid needs
+    id: str = Field(alias="_id")
+    nickname: Optional[str] = None
+    brand: Optional[str] = None
+    model: Optional[str] = None
+    device_type: Optional[DeviceType] = None
+    status: Optional[DeviceStatus] = None
+    adopted_date: Optional[datetime] = None
+    purchase_price: Optional[float] = None
+    thumbnail: Optional[str] = None
+    hover_photo: Optional[str] = None
+    main_photo: Optional[str] = None
+    thumbnail_variants: Optional[Dict[str, str]] = None
+    hover_photo_variants: Optional[Dict[str, str]] = None
+
+class DeviceSummary(BaseModel):
+    # autocomplete results
+    id: str = Field(alias="_id")
+    nickname: Optional[str] = None
+    model: Optional[str] = None
+    brand: Optional[str] = None
+    device_type: Optional[DeviceType] = None
+    status: Optional[DeviceStatus] = None
+
+
+# expand=paired,gallery: referenced devices resolved inline (card view, null if it is gone)
+
+class ExpandedPairedDevice(PairedDevice):
+    device: Optional[DeviceCard] = None
+
+class ExpandedGalleryPhoto(GalleryPhoto):
+    paired_device: Optional[DeviceCard] = None
+
+class DeviceExpanded(DeviceDetail):
+    gallery: List[ExpandedGalleryPhoto] = []
+    paired_devices: List[ExpandedPairedDevice] = []
+
+
+# PATCH body: every field optional, only the fields that are sent get changed.
+# version is the device version the client last saw (optimistic concurrency).
+# variant maps are left out, the server derives them from the photo urls
+DeviceUpdate = create_model(
+    "DeviceUpdate",
+    version=(Optional[int], None),
+    **{
+        name: (Optional[field.annotation], None) for name, field in DeviceBase.model_fields.items()
+        if not name.endswith("_variants")
+    }
+)
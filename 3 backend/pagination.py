@@ -0,0 +1,85 @@
+# keyset (cursor) pagination helpers for device listings
+
+import base64
+import json
+from datetime import datetime
+from bson import ObjectId
+
+default_page_size = 100
+max_page_size = 500
+
+# lightweight view used by the polaroid grid
+card_fields = [
+    "nickname", "brand", "model", "device_type", "status", "adopted_date", "purchase_price",
+    "thumbnail", "hover_photo", "main_photo", "thumbnail_variants", "hover_photo_variants"
+]
+
+# every sort key besides _id is a required device field (never missing), ties are broken by _id
+sortable_fields = ["_id", "adopted_date", "purchase_price", "nickname", "brand"]
+
+
+def build_projection(fields, allowed_fields):
+    """
+    Turn the fields= query param into a mongo projection.
+    fields can be: None/"full" (whole document), "card", or a comma separated list
+    """
+    if not fields or fields == "full":
+        return None
+    if fields == "card":
+        names = card_fields
+    else:
+        names = [name.strip() for name in fields.split(",") if name.strip()]
+        unknown = [name for name in names if name not in allowed_fields]
+        if unknown:
+            raise ValueError(f"unknown fields: {unknown}")
+    projection = {name: 1 for name in names}
+    # always return _id and the sort key so the next cursor can be built
+    projection["_id"] = 1
+    return projection
+
+
+def encode_cursor(device, sort):
+    """Build an opaque cursor pointing just past the given document"""
+    payload = {"id": str(device["_id"])}
+    if sort != "_id":
+        value = device.get(sort)
+        if isinstance(value, datetime):
+            payload["d"] = value.isoformat()
+        else:
+            payload["v"] = value
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor, sort):
+    """Inverse of encode_cursor. Returns (ObjectId, sort value)"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        last_id = ObjectId(payload["id"])
+        value = payload.get("v")
+        if payload.get("d") is not None:
+            value = datetime.fromisoformat(payload["d"])
+        return last_id, value
+    except Exception:
+        raise ValueError("invalid cursor")
+
+
+def cursor_filter(cursor, sort, descending):
+    """Mongo filter that selects every document after the cursor position"""
+    last_id, value = decode_cursor(cursor, sort)
+    op = "$lt" if descending else "$gt"
+    if sort == "_id":
+        return {"_id": {op: last_id}}
+    # ties on the sort key are broken by _id so no document is skipped or repeated
+    return {"$or": [
+        {sort: {op: value}},
+        {sort: value, "_id": {op: last_id}},
+    ]}
+
+
+def sort_spec(sort, descending):
+    direction = -1 if descending else 1
+    if sort == "_id":
+        return [("_id", direction)]
+    return [(sort, direction), ("_id", direction)]
@@ -0,0 +1,284 @@
+# reference counting for content-addressed photos
+#
+# every stored photo has a document in the photos collection:
+#   {_id: "<sha256><ext>", refs: <number of device fields using it>, created_at,
+#    leased_until, variants: {card, hover, preview, full: url} once its resized copies exist}
+# an upload leases the photo before checking whether it is already stored, so a
+# photo is not deleted between that check and the device write that uses it.
+# when the count drops to zero (and no lease is held) the photo and its resized
+# copies are deleted; photos that were uploaded but never used are swept up
+# once their lease runs out. legacy uuid-named photos are not tracked and never deleted.
+#
+# variant maps on devices (thumbnail_variants, hover_photo_variants,
+# gallery[].variants) are derived here, never taken from the client: a write that
+# changes a photo url also replaces its map, so it can't point at another photo's
+# (possibly deleted) resized copies.
+
+import asyncio
+import os
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from fastapi import HTTPException
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from database import photo_collection
+from storage import key_from_url, object_name_for, local_name_for, delete_stored
+from derivatives import variant_name, variant_sizes, enqueue
+
+# device fields that hold photo urls, used to fetch only what the bookkeeping needs
+photo_projection = {
+    "thumbnail": 1, "hover_photo": 1, "main_photo": 1,
+    "gallery.url": 1, "repairs.photos_before_after": 1
+}
+
+# how long an uploaded photo is kept without a device using it
+upload_grace = timedelta(hours=float(os.getenv("PHOTO_UPLOAD_GRACE_HOURS", "24")))
+# how often unused photos are swept up (per worker process)
+sweep_interval_seconds = float(os.getenv("PHOTO_SWEEP_INTERVAL_SECONDS", "3600"))
+# a deletion that didn't finish by then (e.g. the worker died) is taken over by the sweep
+deletion_timeout = timedelta(minutes=10)
+# how long an upload waits for a deletion of the same photo to finish
+lease_attempts = 50
+lease_retry_seconds = 0.1
+
+# photo fields with a variant map next to them
+variant_fields = {"thumbnail": "thumbnail_variants", "hover_photo": "hover_photo_variants"}
+variant_projection = {"thumbnail_variants": 1, "hover_photo_variants": 1, "gallery.variants": 1}
+
+
+def photo_urls(device):
+    """every photo url referenced by a device document"""
+    if not device:
+        return []
+    urls = [device.get(field) for field in ["thumbnail", "hover_photo", "main_photo"]]
+    urls += [photo.get("url") for photo in device.get("gallery") or []]
+    for repair in device.get("repairs") or []:
+        urls += repair.get("photos_before_after") or []
+    return [url for url in urls if url]
+
+
+def _key_counts(urls):
+    return Counter(key for key in map(key_from_url, urls) if key)
+
+
+async def lease_photo(key):
+    """
+    Keep a photo from being deleted for upload_grace (refs start at 0 until a
+    device uses it). Taken before an upload checks whether the photo is already
+    stored; while the photo is being deleted it waits, and the upload then
+    stores the photo again.
+    """
+    for attempt in range(lease_attempts):
+        now = datetime.now(timezone.utc)
+        try:
+            await photo_collection.update_one(
+                {"_id": key, "deleting": {"$exists": False}},
+                {"$max": {"leased_until": now + upload_grace}, "$setOnInsert": {"refs": 0, "created_at": now}},
+                upsert=True
+            )
+            return
+        except DuplicateKeyError:
+            # the document exists but is claimed for deletion
+            await asyncio.sleep(lease_retry_seconds)
+    raise HTTPException(status_code=503, detail="Photo is being removed, try again")
+
+
+async def add_refs(urls):
+    await _add_keys(_key_counts(urls))
+
+
+async def release_refs(urls):
+    """drop references and garbage collect photos nobody uses anymore"""
+    await _release_keys(_key_counts(urls))
+
+
+async def update_refs(old_device, new_device):
+    """adjust counts for a device whose photos changed from old_device to new_device"""
+    old_counts = _key_counts(photo_urls(old_device))
+    new_counts = _key_counts(photo_urls(new_device))
+    await _add_keys(new_counts - old_counts)
+    await _release_keys(old_counts - new_counts)
+
+
+async def _add_keys(counts):
+    for key, count in counts.items():
+        await photo_collection.update_one(
+            {"_id": key},
+            {"$inc": {"refs": count}, "$setOnInsert": {"created_at": datetime.now(timezone.utc)}},
+            upsert=True
+        )
+
+
+async def _release_keys(counts):
+    for key, count in counts.items():
+        photo = await photo_collection.find_one_and_update(
+            {"_id": key},
+            {"$inc": {"refs": -count}},
+            return_document=ReturnDocument.AFTER
+        )
+        if photo is None or photo["refs"] > 0:
+            continue
+        now = datetime.now(timezone.utc)
+        await _collect(key, {"$or": [{"leased_until": {"$exists": False}}, {"leased_until": {"$lt": now}}]}, now)
+
+
+def _unused_filter(now):
+    """photos no device uses whose lease (or, without one, upload grace) is over"""
+    return {"refs": {"$lte": 0}, "$or": [
+        {"leased_until": {"$lt": now}},
+        {"leased_until": {"$exists": False}, "created_at": {"$lt": now - upload_grace}},
+    ]}
+
+
+def _claimable(now):
+    """not being deleted, or by a deletion that was abandoned"""
+    return {"$or": [{"deleting": {"$exists": False}}, {"deleting": {"$lt": now - deletion_timeout}}]}
+
+
+async def _collect(key, conditions, now):
+    """
+    Delete an unused photo. It is claimed first (deleting), which makes uploads
+    of the same photo wait, then its files go and finally the document.
+    """
+    claimed = await photo_collection.find_one_and_update(
+        {"$and": [{"_id": key, "refs": {"$lte": 0}}, conditions, _claimable(now)]},
+        {"$set": {"deleting": now}}
+    )
+    if claimed is None:
+        return False  # used, leased or being deleted again in the meantime
+    await delete_photo_files(key)
+    await photo_collection.delete_one({"_id": key})
+    return True
+
+
+async def sweep_unused(limit=1000):
+    """delete photos that were uploaded but never used, once their lease ran out"""
+    now = datetime.now(timezone.utc)
+    unused = photo_collection.find(
+        {"$and": [_unused_filter(now), _claimable(now)]},
+        {"_id": 1}
+    ).limit(limit)
+    swept = 0
+    async for photo in unused:
+        if await _collect(photo["_id"], _unused_filter(now), now):
+            swept += 1
+    return swept
+
+
+async def delete_photo_files(key):
+    object_name, local_name = object_name_for(key), local_name_for(key)
+    try:
+        await delete_stored(object_name, local_name)
+        for variant in variant_sizes:
+            await delete_stored(variant_name(object_name, variant), variant_name(local_name, variant))
+    except Exception as e:
+        print(f"Error deleting photo {key}: {e}")
+
+
+async def generated_variants(urls):
+    """{url: variant map} for the content addressed photos among urls whose variants exist"""
+    urls_by_key = {}
+    for url in urls:
+        key = key_from_url(url)
+        if key:
+            urls_by_key.setdefault(key, set()).add(url)
+    found = {}
+    if urls_by_key:
+        photos = photo_collection.find(
+            {"_id": {"$in": list(urls_by_key)}, "variants": {"$exists": True}},
+            {"variants": 1}
+        )
+        async for photo in photos:
+            for url in urls_by_key[photo["_id"]]:
+                found[url] = photo["variants"]
+    return found
+
+
+def _current_variants(device):
+    """{url: variant map} of the photos a stored device has maps for"""
+    current = {}
+    if not device:
+        return current
+    for url_field, map_field in variant_fields.items():
+        if device.get(url_field) and device.get(map_field):
+            current[device[url_field]] = device[map_field]
+    for photo in device.get("gallery") or []:
+        if photo.get("url") and photo.get("variants"):
+            current[photo["url"]] = photo["variants"]
+    return current
+
+
+async def assign_variants(device, old_device=None, generated=None):
+    """
+    Set the variant maps of a device document about to be written (in place):
+    a photo old_device already had keeps its map, any other one gets the variants
+    generated for the same content, or no map until the worker records them.
+    generated can be passed in when many devices are written together.
+    Returns the urls whose variants are missing, for queue_variants() once the
+    write is done.
+    """
+    current = _current_variants(old_device)
+    gallery = device.get("gallery") or []
+    urls = [device.get(field) for field in variant_fields] + [photo.get("url") for photo in gallery]
+    urls = [url for url in urls if url]
+    if generated is None:
+        generated = await generated_variants([url for url in urls if url not in current])
+
+    missing = []
+
+    def variants_for(url):
+        variants = current.get(url) or generated.get(url)
+        if not variants and url not in missing:
+            missing.append(url)
+        return variants
+
+    for url_field, map_field in variant_fields.items():
+        variants = variants_for(device[url_field]) if device.get(url_field) else None
+        if variants:
+            device[map_field] = variants
+        else:
+            device.pop(map_field, None)
+    for photo in gallery:
+        variants = variants_for(photo["url"]) if photo.get("url") else None
+        if variants:
+            photo["variants"] = variants
+        else:
+            photo.pop("variants", None)
+    return missing
+
+
+async def variant_update(update, old_device):
+    """
+    Add the variant map changes that go with the photos a PATCH update sets or
+    removes. Returns the urls whose variants are missing (see assign_variants).
+    """
+    set_fields, unset_fields = update.get("$set", {}), update.get("$unset", {})
+    photos = {
+        field: set_fields.get(field)
+        for field in [*variant_fields, "gallery"] if field in set_fields or field in unset_fields
+    }
+    if not photos:
+        return []
+    missing = await assign_variants(photos, old_device)
+    for url_field, map_field in variant_fields.items():
+        if url_field not in photos:
+            continue
+        set_fields.pop(map_field, None)
+        unset_fields.pop(map_field, None)
+        if photos.get(map_field):
+            set_fields[map_field] = photos[map_field]
+        else:
+            unset_fields[map_field] = ""
+    # gallery entries were updated in place
+    for operator, fields in [("$set", set_fields), ("$unset", unset_fields)]:
+        if fields:
+            update[operator] = fields
+    return missing
+
+
+def queue_variants(urls):
+    """have the derivative worker generate (and record) the variants of stored photos"""
+    for url in urls:
+        key = key_from_url(url)
+        if key:
+            enqueue(url, object_name_for(key), local_name_for(key))
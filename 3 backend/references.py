@@ -0,0 +1,118 @@
+# links between devices: paired_devices[].device_id and gallery[].paired_device_id
+#
+# expand=paired,gallery resolves the referenced devices of a response in one
+# batched $in query. pairings keep a copy of the target's nickname/model, which is
+# refreshed when the target is renamed; references to a deleted device are removed.
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from cache import versioned
+from database import update_array_items
+from pagination import card_fields
+
+expand_options = ["paired", "gallery"]
+
+# what an expanded reference shows of the other device (same as a grid card)
+reference_projection = {field: 1 for field in card_fields}
+
+# the names a pairing keeps a copy of
+copied_fields = ["nickname", "model"]
+
+
+def parse_expand(expand):
+    """'paired,gallery' -> ("gallery", "paired"); ValueError on unknown options"""
+    if not expand:
+        return ()
+    options = {option.strip() for option in expand.split(",") if option.strip()}
+    unknown = sorted(options - set(expand_options))
+    if unknown:
+        raise ValueError(f"unknown expand options: {unknown}, pick from {expand_options}")
+    return tuple(sorted(options))
+
+
+class DeviceLoader:
+    """
+    Per request loader for referenced devices: ids are de-duplicated and
+    fetched together, and a device is only read once however often it is referenced.
+    """
+
+    def __init__(self, collection, projection=None):
+        self._collection = collection
+        self._projection = projection or reference_projection
+        self._devices = {}  # id -> card view, None when it doesn't exist (any more)
+
+    async def load_many(self, ids):
+        missing = {device_id for device_id in ids if device_id not in self._devices}
+        object_ids = []
+        for device_id in missing:
+            self._devices[device_id] = None
+            try:
+                object_ids.append(ObjectId(device_id))
+            except (InvalidId, TypeError):
+                pass  # a malformed id can only be a dangling reference
+        if object_ids:
+            found = self._collection.find({"_id": {"$in": object_ids}}, self._projection)
+            async for device in found:
+                self._devices[str(device["_id"])] = device
+        return {device_id: self._devices[device_id] for device_id in ids}
+
+
+def _paired_ids(device):
+    return [pairing.get("device_id") for pairing in device.get("paired_devices") or []]
+
+
+def _gallery_ids(device):
+    return [photo.get("paired_device_id") for photo in device.get("gallery") or []]
+
+
+async def expand_references(devices, expand, loader):
+    """
+    Add the referenced device (card view) to the pairings and gallery photos of
+    every device: paired_devices[].device and gallery[].paired_device (null when the
+    reference points nowhere). Pairings also get the current nickname/model.
+    """
+    ids = []
+    for device in devices:
+        if "paired" in expand:
+            ids += _paired_ids(device)
+        if "gallery" in expand:
+            ids += _gallery_ids(device)
+    references = await loader.load_many(list(dict.fromkeys(device_id for device_id in ids if device_id)))
+
+    for device in devices:
+        if "paired" in expand:
+            for pairing in device.get("paired_devices") or []:
+                target = references.get(pairing.get("device_id"))
+                pairing["device"] = target
+                if target:
+                    for field in copied_fields:
+                        pairing[field] = target.get(field)
+        if "gallery" in expand:
+            for photo in device.get("gallery") or []:
+                photo["paired_device"] = references.get(photo.get("paired_device_id"))
+    return devices
+
+
+async def refresh_pairing_names(collection, device):
+    """copy a renamed device's nickname/model into every pairing that points at it"""
+    device_id = str(device["_id"])
+    # PUT, PATCH and import can store the same pairing twice, so update every match
+    return await update_array_items(
+        collection, {"paired_devices.device_id": device_id}, "paired_devices",
+        {"device_id": device_id}, {field: device.get(field) for field in copied_fields},
+        versioned({})
+    )
+
+
+async def remove_references(collection, device_id):
+    """drop pairings with a deleted device and untag it from gallery photos"""
+    device_id = str(device_id)
+    await collection.update_many(
+        {"paired_devices.device_id": device_id},
+        versioned({"$pull": {"paired_devices": {"device_id": device_id}}})
+    )
+    await update_array_items(
+        collection, {"gallery.paired_device_id": device_id}, "gallery",
+        {"paired_device_id": device_id}, {"paired_device_id": None},
+        versioned({})
+    )
@@ -0,0 +1,284 @@
+# device search: indexed prefix tokens, full-text ranking and in-process autocomplete
+
+import asyncio
+import bisect
+import re
+import unicodedata
+from datetime import timedelta
+from cache import now, current_generation
+from database import deletion_collection, deletion_log_seconds
+
+# fields that are searchable, with their ranking weight
+field_weights = {"nickname": 3, "model": 2, "brand": 1}
+
+# prefixes longer than this are not stored, longer query tokens are truncated to match
+max_prefix_length = 15
+
+# small view returned by autocomplete lookups
+autocomplete_fields = ["nickname", "model", "brand", "device_type", "status"]
+
+token_split = re.compile(r"[^0-9a-z]+")
+
+# the autocomplete index catches up on devices written since its last sync, with
+# this much overlap for writes that were still in flight (or clock skew between workers)
+sync_overlap = timedelta(seconds=60)
+# an index that hasn't synced for longer may have missed deletions that already
+# expired from the deletion log, it is loaded again instead
+max_sync_gap = timedelta(seconds=deletion_log_seconds) - sync_overlap
+
+
+def normalize(text):
+    """lowercase, strip accents and split into alphanumeric tokens"""
+    if not text:
+        return []
+    text = unicodedata.normalize("NFKD", str(text))
+    text = "".join(ch for ch in text if not unicodedata.combining(ch)).lower()
+    return [token for token in token_split.split(text) if token]
+
+
+def query_tokens(query):
+    """tokens of a user query, truncated so they can be matched against stored prefixes"""
+    tokens = []
+    for token in normalize(query):
+        token = token[:max_prefix_length]
+        if token not in tokens:
+            tokens.append(token)
+    return tokens
+
+
+def build_search_tokens(device):
+    """every prefix of every token in the searchable fields (stored as search_tokens)"""
+    prefixes = set()
+    for field in field_weights:
+        for token in normalize(device.get(field)):
+            for end in range(1, min(len(token), max_prefix_length) + 1):
+                prefixes.add(token[:end])
+    return sorted(prefixes)
+
+
+def build_search_words(device):
+    """normalized words of each searchable field (stored as search_words, used for ranking)"""
+    return {field: normalize(device.get(field)) for field in field_weights}
+
+
+def search_fields(device):
+    """the bookkeeping fields search needs on a stored device"""
+    return {"search_tokens": build_search_tokens(device), "search_words": build_search_words(device)}
+
+
+def score(device, tokens):
+    """
+    Rank a device against query tokens.
+    An exact token match counts double a prefix match, weighted by field.
+    """
+    total = 0
+    for query_token in tokens:
+        best = 0
+        for field, weight in field_weights.items():
+            for token in normalize(device.get(field)):
+                if token == query_token:
+                    best = max(best, weight * 2)
+                elif token.startswith(query_token):
+                    best = max(best, weight)
+        total += best
+    return total
+
+
+def rank(devices, tokens):
+    return sorted(devices, key=lambda d: (-score(d, tokens), (d.get("nickname") or "").lower()))
+
+
+def _score_expression(tokens):
+    """score() as an aggregation expression over the stored search_words"""
+    per_token = []
+    for query_token in tokens:
+        per_field = []
+        for field, weight in field_weights.items():
+            words = {"$ifNull": [f"$search_words.{field}", []]}
+            starts = {"$filter": {
+                "input": words, "as": "word",
+                # query tokens are [0-9a-z] only, nothing to escape
+                "cond": {"$regexMatch": {"input": "$$word", "regex": f"^{query_token}"}}
+            }}
+            per_field.append({"$cond": [
+                {"$in": [query_token, words]}, weight * 2,
+                {"$cond": [{"$gt": [{"$size": starts}, 0]}, weight, 0]}
+            ]})
+        per_token.append({"$max": per_field})
+    return {"$add": per_token}
+
+
+def rank_pipeline(tokens, filters, limit):
+    """
+    Every device matching all query tokens, ranked like rank() inside mongo,
+    so the best matches are found however many devices match. Returns _ids only.
+    """
+    return [
+        {"$match": {"search_tokens": {"$all": tokens}, **filters}},
+        {"$project": {
+            "score": _score_expression(tokens),
+            "name": {"$toLower": {"$ifNull": ["$nickname", ""]}},
+        }},
+        {"$sort": {"score": -1, "name": 1, "_id": 1}},
+        {"$limit": limit},
+        {"$project": {"_id": 1}},
+    ]
+
+
+async def ensure_search_indexes(collection):
+    """create the search indexes (documents written before search_words existed: see backfill_search.py)"""
+    await collection.create_index([("search_tokens", 1)])
+    await collection.create_index(
+        [(field, "text") for field in field_weights],
+        weights=field_weights,
+        name="device_text"
+    )
+
+
+class AutocompleteIndex:
+    """
+    Sorted prefix index over nickname/model/brand tokens, kept in memory.
+    Answers dropdown lookups without reading devices. It is per worker process:
+    it is loaded in the background after startup and updated by this worker's
+    write endpoints. Writes made by other workers show up as a new collection
+    generation (see cache.py), refresh() then catches up before the next lookup.
+    """
+
+    def __init__(self):
+        self._terms = []    # sorted list of (token, device_id)
+        self._devices = {}  # device_id -> autocomplete view
+        self.loaded = False
+        self._changes = None  # writes made while a load is running, replayed on top of it
+        self._load_lock = asyncio.Lock()
+        self.generation = None  # collection generation the index is in sync with
+        self._synced_at = None  # devices updated after this may be missing
+
+    def __len__(self):
+        return len(self._devices)
+
+    def _tokens(self, device):
+        tokens = set()
+        for field in field_weights:
+            tokens.update(normalize(device.get(field)))
+        return tokens
+
+    async def load(self, collection):
+        async with self._load_lock:
+            await self._load(collection)
+
+    async def _load(self, collection):
+        generation, started = await current_generation(), now()
+        self._changes = []
+        terms = []
+        devices = {}
+        projection = {field: 1 for field in autocomplete_fields}
+        try:
+            async for device in collection.find({}, projection):
+                device_id = str(device.pop("_id"))
+                devices[device_id] = device
+                terms.extend((token, device_id) for token in self._tokens(device))
+        except BaseException:
+            self._changes = None
+            raise
+        terms.sort()
+        changes, self._changes = self._changes, None
+        self._terms, self._devices = terms, devices
+        for apply, args in changes:
+            apply(*args)
+        self.generation, self._synced_at = generation, started
+        self.loaded = True
+
+    async def refresh(self, collection):
+        """
+        Catch up with writes other workers made since the last sync: changed and
+        new devices are read by updated_at, deleted ones from the deletion log
+        (see record_deletion). Costs one small read while nothing changed.
+        """
+        generation = await current_generation()
+        if generation == self.generation:
+            return
+        async with self._load_lock:
+            if generation == self.generation:
+                return
+            generation, started = await current_generation(), now()
+            if started - self._synced_at > max_sync_gap:
+                await self._load(collection)
+                return
+            since = self._synced_at - sync_overlap
+            # deletions first: an id that was deleted and imported again ends up indexed
+            async for deleted in deletion_collection.find({"deleted_at": {"$gte": since}}, {"_id": 1}):
+                self._remove(deleted["_id"])
+            projection = {field: 1 for field in autocomplete_fields}
+            async for device in collection.find({"updated_at": {"$gte": since}}, projection):
+                self._upsert(str(device.pop("_id")), device)
+            self.generation, self._synced_at = generation, started
+
+    def upsert(self, device_id, device):
+        device_id = str(device_id)
+        view = {field: device.get(field) for field in autocomplete_fields}
+        # enums come through as their value when stored from a pydantic dump
+        for field in ["device_type", "status"]:
+            view[field] = getattr(view[field], "value", view[field])
+        if self._changes is not None:
+            self._changes.append((self._upsert, (device_id, view)))
+        self._upsert(device_id, view)
+
+    def remove(self, device_id):
+        device_id = str(device_id)
+        if self._changes is not None:
+            self._changes.append((self._remove, (device_id,)))
+        self._remove(device_id)
+
+    def _upsert(self, device_id, view):
+        self._remove(device_id)
+        self._devices[device_id] = view
+        for token in self._tokens(view):
+            bisect.insort(self._terms, (token, device_id))
+
+    def _remove(self, device_id):
+        view = self._devices.pop(device_id, None)
+        if view is None:
+            return
+        for token in self._tokens(view):
+            position = bisect.bisect_left(self._terms, (token, device_id))
+            if position < len(self._terms) and self._terms[position] == (token, device_id):
+                del self._terms[position]
+
+    def _prefix_ids(self, prefix):
+        ids = set()
+        position = bisect.bisect_left(self._terms, (prefix, ""))
+        while position < len(self._terms) and self._terms[position][0].startswith(prefix):
+            ids.add(self._terms[position][1])
+            position += 1
+        return ids
+
+    def lookup(self, query, limit=20, device_type=None, status=None):
+        tokens = normalize(query)
+        if not tokens:
+            return []
+        ids = None
+        for token in tokens:
+            matches = self._prefix_ids(token)
+            ids = matches if ids is None else ids & matches
+            if not ids:
+                return []
+        results = []
+        for device_id in ids:
+            view = self._devices[device_id]
+            if device_type and view.get("device_type") != device_type:
+                continue
+            if status and view.get("status") != status:
+                continue
+            results.append({"_id": device_id, **view})
+        return rank(results, tokens)[:limit]
+
+
+autocomplete_index = AutocompleteIndex()
+
+
+async def record_deletion(device_id):
+    """log a deleted device for the autocomplete index of every worker (call before devices_changed)"""
+    autocomplete_index.remove(device_id)
+    await deletion_collection.update_one(
+        {"_id": str(device_id)}, {"$set": {"deleted_at": now()}}, upsert=True
+    )
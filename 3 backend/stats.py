@@ -0,0 +1,108 @@
+# collection analytics, computed by mongodb aggregation pipelines
+
+from datetime import datetime, timezone
+
+group_fields = ["device_type", "status", "brand"]
+
+# parts cost of all repairs of a device
+repair_cost_expression = {"$sum": {"$map": {
+    "input": {"$ifNull": ["$repairs", []]},
+    "as": "repair",
+    "in": {"$sum": {"$ifNull": ["$$repair.parts_used.cost", []]}},
+}}}
+repair_hours_expression = {"$sum": {"$ifNull": ["$repairs.time_spent", []]}}
+
+money_fields = ["purchase_price", "current_value", "repair_cost", "repair_hours"]
+
+
+def summary_pipeline(group_by):
+    """totals of purchase price, current value and repair spend per group"""
+    return [
+        {"$project": {
+            "group": f"${group_by}",
+            "purchase_price": {"$ifNull": ["$purchase_price", 0]},
+            "current_value": {"$ifNull": ["$current_value", 0]},
+            "repair_cost": repair_cost_expression,
+            "repair_hours": repair_hours_expression,
+        }},
+        {"$group": {
+            "_id": "$group",
+            "count": {"$sum": 1},
+            **{field: {"$sum": f"${field}"} for field in money_fields},
+        }},
+        {"$sort": {"_id": 1}},
+    ]
+
+
+def summarize(groups, group_by):
+    """shape summary_pipeline output and add overall totals"""
+    rows = []
+    totals = {"count": 0, **{field: 0 for field in money_fields}}
+    for group in groups:
+        row = {group_by: group["_id"], "count": group["count"]}
+        for field in money_fields:
+            row[field] = round(group[field], 2)
+            totals[field] += group[field]
+        totals["count"] += group["count"]
+        # what the collection is worth now vs what went into it
+        row["value_change"] = round(row["current_value"] - row["purchase_price"] - row["repair_cost"], 2)
+        rows.append(row)
+    totals = {field: round(value, 2) for field, value in totals.items()}
+    totals["value_change"] = round(totals["current_value"] - totals["purchase_price"] - totals["repair_cost"], 2)
+    return {"group_by": group_by, "totals": totals, "groups": rows}
+
+
+def repairs_by_month_pipeline(months):
+    """number of repairs, parts cost and time spent per calendar month"""
+    today = datetime.now(timezone.utc)
+    year, month = today.year, today.month - (months - 1)
+    while month <= 0:
+        year, month = year - 1, month + 12
+    since = datetime(year, month, 1, tzinfo=timezone.utc)
+    return [
+        {"$match": {"repairs.date": {"$gte": since}}},
+        {"$unwind": "$repairs"},
+        {"$match": {"repairs.date": {"$gte": since}}},
+        {"$group": {
+            "_id": {"$dateToString": {"format": "%Y-%m", "date": "$repairs.date"}},
+            "repairs": {"$sum": 1},
+            "parts_cost": {"$sum": {"$sum": {"$ifNull": ["$repairs.parts_used.cost", []]}}},
+            "time_spent": {"$sum": {"$ifNull": ["$repairs.time_spent", 0]}},
+        }},
+        {"$sort": {"_id": 1}},
+        {"$project": {"_id": 0, "month": "$_id", "repairs": 1, "parts_cost": 1, "time_spent": 1}},
+    ]
+
+
+def maintenance_pipeline(interval_days, limit):
+    """
+    Active devices ordered by when their next maintenance is due:
+    interval_days after the last repair (or after adoption if never repaired).
+    """
+    return [
+        {"$match": {"status": {"$ne": "retired"}}},
+        {"$project": {
+            "nickname": 1,
+            "model": 1,
+            "device_type": 1,
+            "status": 1,
+            "last_repair": {"$max": {"$ifNull": ["$repairs.date", []]}},
+            "adopted_date": 1,
+        }},
+        {"$addFields": {
+            "due_date": {"$add": [
+                {"$ifNull": ["$last_repair", "$adopted_date"]},
+                interval_days * 24 * 60 * 60 * 1000,
+            ]},
+        }},
+        {"$sort": {"due_date": 1}},
+        {"$limit": limit},
+    ]
+
+
+def shape_maintenance(devices):
+    now = datetime.now(timezone.utc).replace(tzinfo=None)  # mongo dates come back naive utc
+    for device in devices:
+        device["_id"] = str(device["_id"])
+        device["overdue"] = device["due_date"] is not None and device["due_date"] < now
+    return devices
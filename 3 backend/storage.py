@@ -0,0 +1,348 @@
+# photo storage: google cloud storage with a local ./uploads fallback
+
+import os
+import re
+import uuid
+import asyncio
+import hashlib
+from dotenv import load_dotenv
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+
+load_dotenv()
+
+# every object written here is named after its content (or is a variant of such
+# an object), so it never changes and browsers/CDNs may keep it for good
+immutable_cache_control = "public, max-age=31536000, immutable"
+# GCS_SIGNED_URLS=true: objects stay private, clients get short lived signed urls
+# from /photos/{name} instead of public urls (see delivery.py)
+signed_urls = os.getenv("GCS_SIGNED_URLS", "false").lower() in ("1", "true", "yes")
+
+# max size of a single uploaded file, and of the files of one gallery upload
+max_upload_bytes = int(os.getenv("MAX_UPLOAD_MB", "25")) * 1024 * 1024
+max_upload_files = int(os.getenv("MAX_UPLOAD_FILES", "20"))
+upload_chunk_size = 1024 * 1024
+# room for multipart boundaries and the other form fields
+form_overhead_bytes = 64 * 1024
+# how many files of one request are sent to storage at the same time
+max_concurrent_uploads = int(os.getenv("MAX_CONCURRENT_UPLOADS", "4"))
+
+# gcs is connected on first use (see get_bucket): creating the client runs
+# credential discovery, which can take seconds and would slow every worker's start
+storage_client = None
+bucket = None
+gcs_local_dir = os.getenv("GCS_LOCAL_DIR")
+_bucket_ready = False
+_bucket_lock = asyncio.Lock()
+
+
+def _connect_bucket():
+    """blocking: build the gcs client and bucket (or the local stand-in)"""
+    global storage_client, bucket
+    if gcs_local_dir:
+        # filesystem stand-in for the bucket (offline runs / benchmarks)
+        from local_bucket import LocalBucket
+        bucket = LocalBucket(gcs_local_dir, os.getenv("GCS_BUCKET_NAME", "local-bucket"))
+        print(f"Using local directory '{gcs_local_dir}' as the GCS bucket")
+        return
+    bucket_name = os.getenv("GCS_BUCKET_NAME")
+    if not bucket_name:
+        print("Warning: GCS_BUCKET_NAME not set. Photo uploads will be disabled.")
+        return
+    try:
+        from google.cloud import storage
+        storage_client = storage.Client()
+        bucket = storage_client.bucket(bucket_name)
+        print(f"GCS bucket '{bucket_name}' connected successfully!")
+    except Exception as e:
+        print(f"Warning: Could not initialize GCS: {e}")
+        print("Photo uploads will be disabled.")
+
+
+async def get_bucket():
+    """the gcs bucket, or None when photos go to ./uploads. connects on the first call"""
+    global _bucket_ready
+    if not _bucket_ready:
+        async with _bucket_lock:
+            if not _bucket_ready:
+                await run_in_threadpool(_connect_bucket)
+                _bucket_ready = True
+    return bucket
+
+
+def storage_status():
+    if not _bucket_ready:
+        return "not connected yet"
+    return "gcs" if bucket else "local"
+
+
+# local upload directory as fallback
+upload_directory = "./uploads"
+if not os.path.exists(upload_directory):
+    os.makedirs(upload_directory)
+
+# photos are stored under the sha-256 of their content: "<hex digest><ext>"
+content_key_pattern = re.compile(r"^[0-9a-f]{64}\.[0-9a-z]+$")
+
+
+def too_large():
+    return HTTPException(
+        status_code=413,
+        detail=f"File too large (max {max_upload_bytes // (1024 * 1024)} MB)"
+    )
+
+
+# photo upload routes, with the most files one request may carry
+upload_routes = [
+    (re.compile(r"^/upload-photo$"), 1),
+    (re.compile(r"^/devices/[^/]+/upload-photo$"), max_upload_files),
+]
+
+
+class UploadLimitMiddleware:
+    """
+    Caps the request body of the photo upload routes while it arrives, before
+    the multipart form is parsed (and spooled to disk): a Content-Length over the
+    limit is refused without reading the body, and a body without one (chunked)
+    fails as soon as it goes over. Each file is checked again in _read_chunks.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        limit = None
+        if scope["type"] == "http":
+            for pattern, file_count in upload_routes:
+                if pattern.match(scope["path"]):
+                    limit = max_upload_bytes * file_count + form_overhead_bytes
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        content_length = Headers(scope=scope).get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > limit:
+            response = JSONResponse({"detail": too_large().detail}, status_code=413)
+            await response(scope, receive, send)
+            return
+
+        received = [0]
+
+        async def limited_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                received[0] += len(message.get("body", b""))
+                if received[0] > limit:
+                    # fastapi passes an HTTPException raised while reading the form through
+                    raise too_large()
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+async def _read_chunks(file: UploadFile):
+    """yield the upload in fixed size chunks, failing as soon as it goes over the limit"""
+    await file.seek(0)
+    total = 0
+    while True:
+        chunk = await file.read(upload_chunk_size)
+        if not chunk:
+            break
+        total += len(chunk)
+        if total > max_upload_bytes:
+            raise too_large()
+        yield chunk
+
+
+async def _upload_to_gcs(file: UploadFile, object_name):
+    blob = bucket.blob(object_name)
+    blob.cache_control = immutable_cache_control
+    # resumable upload: the object only exists once the writer is closed,
+    # so bailing out half way (e.g. file too large) leaves nothing behind
+    writer = await run_in_threadpool(
+        blob.open, "wb", content_type=file.content_type, chunk_size=upload_chunk_size * 8
+    )
+    async for chunk in _read_chunks(file):
+        await run_in_threadpool(writer.write, chunk)
+    await run_in_threadpool(writer.close)
+    if not signed_urls:
+        await run_in_threadpool(blob.make_public)
+    return blob.public_url
+
+
+async def _upload_to_disk(file: UploadFile, local_name):
+    local_path = os.path.join(upload_directory, local_name)
+    # write next to the final name and rename, so readers never see a partial file
+    partial_path = f"{local_path}.{uuid.uuid4()}.part"
+    f = await run_in_threadpool(open, partial_path, "wb")
+    try:
+        async for chunk in _read_chunks(file):
+            await run_in_threadpool(f.write, chunk)
+    except BaseException:
+        await run_in_threadpool(f.close)
+        await run_in_threadpool(os.remove, partial_path)
+        raise
+    await run_in_threadpool(f.close)
+    await run_in_threadpool(os.replace, partial_path, local_path)
+    return f"/static/{local_name}"
+
+
+def object_name_for(key):
+    return f"devices/photos/{key}"
+
+
+def local_name_for(key):
+    return key
+
+
+def key_from_url(url):
+    """content key of a photo url, None for legacy (uuid named) photos"""
+    if not url:
+        return None
+    name = url.split("?")[0].rsplit("/", 1)[-1]
+    return name if content_key_pattern.match(name) else None
+
+
+# extension of a stored photo by its leading bytes, so the same image always gets
+# the same key whatever the client named it: (offset, signature, extension)
+image_signatures = [
+    (0, b"\xff\xd8\xff", ".jpg"),
+    (0, b"\x89PNG\r\n\x1a\n", ".png"),
+    (0, b"GIF8", ".gif"),
+    (8, b"WEBP", ".webp"),
+    (0, b"BM", ".bmp"),
+    (0, b"II*\x00", ".tif"),
+    (0, b"MM\x00*", ".tif"),
+    (4, b"ftypavif", ".avif"),
+    (4, b"ftypheic", ".heic"),
+    (4, b"ftypheix", ".heic"),
+    (4, b"ftypmif1", ".heic"),
+]
+# when the format isn't recognized, by the (already validated) content type
+content_type_extensions = {
+    "image/jpeg": ".jpg", "image/png": ".png", "image/gif": ".gif", "image/webp": ".webp",
+    "image/bmp": ".bmp", "image/tiff": ".tif", "image/avif": ".avif",
+    "image/heic": ".heic", "image/heif": ".heic", "image/svg+xml": ".svg",
+}
+
+
+def _extension(head, content_type):
+    for offset, signature, extension in image_signatures:
+        if head[offset:offset + len(signature)] == signature:
+            return extension
+    return content_type_extensions.get((content_type or "").split(";")[0].strip().lower(), ".jpg")
+
+
+async def _content_key(file: UploadFile):
+    """sha-256 of the upload, read in chunks (this also enforces the size limit)"""
+    digest = hashlib.sha256()
+    head = None
+    async for chunk in _read_chunks(file):
+        if head is None:
+            head = chunk[:16]
+        digest.update(chunk)
+    return f"{digest.hexdigest()}{_extension(head or b'', file.content_type)}"
+
+
+async def exists_stored(object_name, local_name):
+    if await get_bucket():
+        return await run_in_threadpool(bucket.blob(object_name).exists)
+    return os.path.exists(os.path.join(upload_directory, local_name))
+
+
+async def save_upload(file: UploadFile, lease=None):
+    """
+    Store an uploaded file under the hash of its content, in GCS or ./uploads.
+    The upload is hashed first, so a file that is already stored is not sent again.
+    lease(key) is awaited before that check (see photos.lease_photo), so the stored
+    file can't be garbage collected before it is used.
+    Memory use is bounded by the chunk size and blocking I/O runs in the thread pool.
+    Returns {"url", "key", "created"}.
+    """
+    key = await _content_key(file)
+    object_name, local_name = object_name_for(key), local_name_for(key)
+    if lease:
+        await lease(key)
+
+    created = False
+    if not await exists_stored(object_name, local_name):  # also connects the bucket
+        if bucket:
+            await _upload_to_gcs(file, object_name)
+        else:
+            await _upload_to_disk(file, local_name)
+        created = True
+
+    return {"url": stored_url(object_name, local_name), "key": key, "created": created}
+
+
+def stored_url(object_name, local_name):
+    """public URL of a stored object (the bucket must be connected, see get_bucket)"""
+    if bucket and signed_urls:
+        return f"/photos/{local_name}"  # redirects to a signed url
+    if bucket:
+        return bucket.blob(object_name).public_url
+    return f"/static/{local_name}"
+
+
+async def save_bytes(data, object_name, local_name, content_type):
+    """store an in-memory file (e.g. a generated image) and return its URL"""
+    if await get_bucket():
+        blob = bucket.blob(object_name)
+        blob.cache_control = immutable_cache_control
+        await run_in_threadpool(blob.upload_from_string, data, content_type=content_type)
+        if not signed_urls:
+            await run_in_threadpool(blob.make_public)
+        return stored_url(object_name, local_name)
+
+    def write():
+        with open(os.path.join(upload_directory, local_name), "wb") as f:
+            f.write(data)
+
+    await run_in_threadpool(write)
+    return f"/static/{local_name}"
+
+
+async def read_stored(object_name, local_name):
+    """read back a stored file"""
+    if await get_bucket():
+        return await run_in_threadpool(bucket.blob(object_name).download_as_bytes)
+
+    def read():
+        with open(os.path.join(upload_directory, local_name), "rb") as f:
+            return f.read()
+
+    return await run_in_threadpool(read)
+
+
+async def delete_stored(object_name, local_name):
+    """remove a previously saved upload, ignoring files that are already gone"""
+    if await get_bucket():
+        blob = bucket.blob(object_name)
+        if await run_in_threadpool(blob.exists):
+            await run_in_threadpool(blob.delete)
+        return
+    local_path = os.path.join(upload_directory, local_name)
+    if os.path.exists(local_path):
+        await run_in_threadpool(os.remove, local_path)
+
+
+async def save_uploads(files, lease=None):
+    """
+    Save several uploads concurrently, keeping order.
+    If one upload fails its error is raised. The files that were stored are not
+    removed here (another request may have leased the same photo in the meantime),
+    garbage collection sweeps them up once their lease runs out.
+    """
+    semaphore = asyncio.Semaphore(max_concurrent_uploads)
+
+    async def save(file):
+        async with semaphore:
+            return await save_upload(file, lease)
+
+    results = await asyncio.gather(*(save(file) for file in files), return_exceptions=True)
+    errors = [result for result in results if isinstance(result, BaseException)]
+    if errors:
+        raise errors[0]
+    return results
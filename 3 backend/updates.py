@@ -0,0 +1,54 @@
+# partial device updates: turn a PATCH body into mongo update operators
+
+from models import DeviceBase
+from search import field_weights
+
+# fields that feed search_tokens (the autocomplete index: search.autocomplete_fields)
+name_fields = set(field_weights)
+# fields that can hold photo urls (photo reference counting)
+photo_fields = {"thumbnail", "hover_photo", "main_photo", "gallery", "repairs"}
+
+
+def removable(name):
+    """a field can be cleared with null when it is optional and defaults to None"""
+    field = DeviceBase.model_fields[name]
+    return not field.is_required() and field.default is None
+
+
+def build_patch(patch):
+    """
+    Returns (update, changed fields) for a DeviceUpdate.
+    Fields sent with a value are $set, fields sent as null are $unset.
+    """
+    data = patch.model_dump(by_alias=True, exclude_unset=True, exclude={"version"})
+    if not data:
+        raise ValueError("no fields to update")
+
+    set_fields = {}
+    unset_fields = {}
+    for name, value in data.items():
+        if value is not None:
+            set_fields[name] = value
+        elif removable(name):
+            unset_fields[name] = ""
+        else:
+            raise ValueError(f"{name} can't be removed")
+
+    update = {}
+    if set_fields:
+        update["$set"] = set_fields
+    if unset_fields:
+        update["$unset"] = unset_fields
+    return update, set(data)
+
+
+def remove_at_pipeline(field, index, updated_at):
+    """pipeline update removing element index of an array field and bumping the version"""
+    return [{"$set": {
+        field: {"$concatArrays": [
+            {"$slice": [f"${field}", index]},
+            {"$slice": [f"${field}", index + 1, 2 ** 31 - 1]},  # everything after index
+        ]},
+        "version": {"$add": [{"$ifNull": ["$version", 0]}, 1]},
+        "updated_at": updated_at,
+    }}]